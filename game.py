@@ -1,11 +1,13 @@
 # Minitest Games
 # Game Engine
 
-import sys, pygame
+import sys, time, pygame
 import game_map
 from pygame.locals import *
 from geometry import *
 from game_utils import fontCache
+from game_profiler import profiler
+from game_events import eventBus, GameEvent, GAME_EVENT_TYPES
 from game_constants import *
 from game_objects import *
 
@@ -13,6 +15,7 @@ from game_objects import *
 # Constants.
 
 DEFAULT_FPS = 30 # frames per second to update the screen
+DEFAULT_MAX_STEPS_PER_FRAME = 5 # simulation steps per frame before the game slows down instead
 
 
 
@@ -32,8 +35,18 @@ class Game( object ):
         self.viewPort = viewPort
         self.clickDragLimit = 10
         self.allowDrag = True
+        self.pixelPerfectPicking = False
         self.fpsClock = pygame.time.Clock()
         self.updateOrder = None
+        self.renderThread = None
+        # Pass game events from the event bus to processEvent(), for games handling them there.
+        # Games subscribing to the event bus directly can turn it off with setProcessGameEvents( False ).
+        self._gameEventSubscribers = []
+        self.setProcessGameEvents( True )
+        # Seconds per simulation step, or None to do one step per frame.
+        self.fixedTimeStep = None
+        self.maxStepsPerFrame = DEFAULT_MAX_STEPS_PER_FRAME
+        self.interpolate = True
         print( "Loading images..." )
         self.images = game_map.ImageStore()
         iconImage = self.images.load( iconName )
@@ -75,6 +88,7 @@ class Game( object ):
 
 
     def terminate( self ):
+        self.setThreadedRendering( False )
         pygame.quit()
         sys.exit()
 
@@ -83,6 +97,11 @@ class Game( object ):
         self.allowDrag = allowDrag
 
 
+    # Clicks on transparent parts of objects fall through to the objects underneath.
+    def setPixelPerfectPicking( self, pixelPerfectPicking = True ):
+        self.pixelPerfectPicking = pixelPerfectPicking
+
+
     def setPaused( self, paused = True ):
         self.paused = paused
         self.gameMap.setPaused( paused )
@@ -93,6 +112,38 @@ class Game( object ):
         self.gameMap.setPaused( self.paused )
 
 
+    def setProcessGameEvents( self, processGameEvents = True ):
+        for eventType, subscriber in self._gameEventSubscribers:
+            eventBus.unsubscribe( eventType, subscriber )
+
+        self._gameEventSubscribers = []
+
+        if processGameEvents:
+            for eventType in GAME_EVENT_TYPES:
+                self._gameEventSubscribers.append( ( eventType, eventBus.subscribe( eventType, self.processEvent ) ) )
+
+
+    # Draw each frame on a separate thread while the next one is updated. The frames shown lag one behind.
+    # Debug drawing and dirty rectangle mode still draw on the main thread.
+    def setThreadedRendering( self, threaded = True ):
+        import viewport
+
+        if threaded and not self.renderThread:
+            self.renderThread = viewport.RenderThread()
+            self.renderThread.start()
+        elif not threaded and self.renderThread:
+            self.renderThread.stop()
+            self.renderThread = None
+
+
+    # Update the game a fixed number of times per second, however long frames take to draw, instead of once a frame.
+    # Frames are drawn part way between steps, unless interpolate is off. A stepsPerSecond of None turns it off.
+    def setFixedTimeStep( self, stepsPerSecond = DEFAULT_FPS, maxStepsPerFrame = DEFAULT_MAX_STEPS_PER_FRAME, interpolate = True ):
+        self.fixedTimeStep = 1.0 / stepsPerSecond if stepsPerSecond else None
+        self.maxStepsPerFrame = maxStepsPerFrame
+        self.interpolate = interpolate
+
+
     def setGameMap( self, gameMap ):
         self.gameMap = gameMap
 
@@ -114,13 +165,20 @@ class Game( object ):
 
 
     def postEvent( self, event ):
-        pygame.event.post( event )
+        if isinstance( event, GameEvent ):
+            eventBus.post( event )
+        else:
+            pygame.event.post( event )
 
 
     def processEvents( self ):
-        # Event handling loop.
-        for event in pygame.event.get():
-            self.processEvent( event )
+        with profiler.phase( 'events' ):
+            # Event handling loop.
+            for event in pygame.event.get():
+                self.processEvent( event )
+
+            # Game events posted since the map moved, such as clicks.
+            eventBus.flush()
 
 
     # Remember mouse button down.
@@ -147,7 +205,7 @@ class Game( object ):
 
             if scene:
                 worldClickPos = viewPort.getWorldCoordinate( self.clickPos )
-                event = scene.collidesWithPoint( worldClickPos, useFullRect=True )
+                event = scene.collidesWithPoint( worldClickPos, useFullRect=True, pixelPerfect=self.pixelPerfectPicking )
                 viewPort.postEvent( event )
         else:
             self.clackPos = clackPos
@@ -167,7 +225,7 @@ class Game( object ):
 
         viewPort = self.viewPort
         worldClickPos = viewPort.getWorldCoordinate( self.clickPos )
-        event = scene.collidesWithPoint( worldClickPos, useFullRect=True )
+        event = scene.collidesWithPoint( worldClickPos, useFullRect=True, pixelPerfect=self.pixelPerfectPicking )
 
         if event and issubclass( type( event.obj ), ( DynamicObject, Portal ) ):
             # print( "Dragging..." )
@@ -229,9 +287,13 @@ class Game( object ):
                 if keyMods & pygame.KMOD_SHIFT:
                     if K_f == event.key:
                         pygame.display.toggle_fullscreen()
+                    elif K_F11 == event.key:
+                        profiler.dump()
             else:
                 if K_ESCAPE == event.key:
                     self.terminate()
+                elif K_F11 == event.key:
+                    profiler.toggle()
                 elif K_F5 == event.key:
                     self.running = False
                 elif K_F12 == event.key:
@@ -325,28 +387,125 @@ class Game( object ):
 
     # Update the game state, map and player.
     def update( self ):
-        self.updateState()
-        self.updateMap()
-        self.updateDragObject()
+        with profiler.phase( 'update' ):
+            self.updateState()
+            self.updateMap()
+            self.updateDragObject()
 
 
     def draw( self ):
         viewPort = self.viewPort
-        gameMap = self.gameMap
 
-        # Draw all the map objects within the view port rectangle.
-        gameMap.draw( viewPort )
+        if not viewPort.rendering:
+            return
+
+        with profiler.phase( 'draw' ):
+            renderThread = self.renderThread
+
+            if renderThread:
+                if not ( viewPort.debugDraw or viewPort.dirtyRectMode ):
+                    # Show the last frame drawn and record this one for drawing.
+                    if renderThread.takeFrame( viewPort.surface ):
+                        with profiler.phase( 'draw.present' ):
+                            viewPort.update()
+
+                    renderThread.submit( viewPort.recordDrawing( self.drawFrame ) )
+
+                    return
+
+                renderThread.waitUntilIdle()
+
+            self.drawFrame( viewPort )
+
+            with profiler.phase( 'draw.present' ):
+                viewPort.update()
 
-        viewPort.update()
 
+    # Draw all the map objects within the view port rectangle, and the profiler overlay when it's on.
+    def drawFrame( self, viewPort ):
+        self.gameMap.draw( viewPort )
+
+        if profiler.enabled and profiler.showOverlay:
+            profiler.drawOverlay( viewPort.surface )
+
+
+    # Wait for the next frame. Headless games run as fast as they can.
+    def tickClock( self ):
+        with profiler.phase( 'wait' ):
+            if self.viewPort.headless:
+                self.fpsClock.tick()
+            else:
+                self.fpsClock.tick( DEFAULT_FPS )
+
+
+    # Run the main game loop, until the game stops running or, optionally, for a number of frames.
+    def run( self, maxFrames = None ):
+        if self.fixedTimeStep:
+            self.runFixedTimeStep( maxFrames )
+            return
 
-    def run( self ):
         self.draw()
+        numFrames = 0
 
         # Main game loop.
-        while self.running:
+        while self.running and ( maxFrames is None or numFrames < maxFrames ):
+            profiler.beginFrame()
             self.update()
             self.draw()
             self.processEvents()
 
-            self.fpsClock.tick( DEFAULT_FPS )
+            self.tickClock()
+            profiler.endFrame()
+            numFrames += 1
+
+
+    # The main game loop for a fixed time step. Each frame does as many steps as the time since the last one
+    # needs, up to maxStepsPerFrame, then draws.
+    def runFixedTimeStep( self, maxFrames = None ):
+        self.draw()
+        numFrames = 0
+        accumulator = 0.0
+        lastTime = time.perf_counter()
+
+        while self.running and ( maxFrames is None or numFrames < maxFrames ):
+            profiler.beginFrame()
+            timeStep = self.fixedTimeStep
+            now = time.perf_counter()
+            accumulator += now - lastTime
+            lastTime = now
+            numSteps = int( accumulator // timeStep )
+
+            if numSteps > self.maxStepsPerFrame:
+                # Too far behind to catch up, so let the game slow down rather than fall further behind.
+                numSteps = self.maxStepsPerFrame
+                accumulator = numSteps * timeStep + accumulator % timeStep
+
+            for step in range( numSteps ):
+                if self.interpolate and step == numSteps - 1:
+                    self.gameMap.saveDrawPositions( self.viewPort )
+
+                self.update()
+                accumulator -= timeStep
+
+            self.drawInterpolated( accumulator / timeStep )
+            self.processEvents()
+
+            self.tickClock()
+            profiler.endFrame()
+            numFrames += 1
+
+
+    # Draw, part way (alpha) between the last two simulation steps if interpolating.
+    def drawInterpolated( self, alpha ):
+        gameMap = self.gameMap
+
+        if not self.interpolate:
+            self.draw()
+            return
+
+        gameMap.interpolateDrawPositions( self.viewPort, alpha )
+
+        try:
+            self.draw()
+        finally:
+            gameMap.restoreDrawPositions()
@@ -5,6 +5,7 @@ import copy, random, pygame, math
 from pygame.locals import *
 from geometry import *
 import game_constants as gc
+import game_events as ge
 import game_objects as go
 
 
@@ -21,6 +22,9 @@ DEFAULT_KEYSMAP = {
 
 DIRECTION_LIST = ( 'left', 'right', 'up', 'down' )
 
+# Number of halvings used to find how far an object can move before contact.
+DEFAULT_MAX_CONTACT_ITERATIONS = 5
+
 
 
 
@@ -218,9 +222,14 @@ class CollisionBoundary( Boundary ):
     def __init__( self, **kwArgs ):
         super().__init__()
         self.collisionPointOffset = kwArgs.get( 'collisionPointOffset', None )
+        self.maxContactIterations = kwArgs.get( 'maxContactIterations', DEFAULT_MAX_CONTACT_ITERATIONS )
         self.resetBlocked()
 
 
+    def setMaxContactIterations( self, maxContactIterations ):
+        self.maxContactIterations = maxContactIterations
+
+
     def collides( self, moveObject, newPos ):
         # Temporarily move to new position to check for collision.
         moveObject.pushPos( newPos )
@@ -267,6 +276,36 @@ class CollisionBoundary( Boundary ):
         return curPos + offsetPos
 
 
+    # Binary search for the furthest distance along a single axis that can be moved without collision.
+    # The probes all fall within the moving object's reach, so reuse the scene's cached nearby objects.
+    def getFreeDistance( self, moveObject, curPos, distance, horizontal ):
+        if not distance:
+            return 0
+
+        axisOffset = horizontal and Point( distance, 0 ) or Point( 0, distance )
+
+        if not self.collides( moveObject, curPos + axisOffset ):
+            return distance
+
+        sign = distance < 0 and -1 or 1
+        free = 0
+        blocked = abs( distance )
+
+        for iteration in range( self.maxContactIterations ):
+            if blocked - free <= 1:
+                break
+
+            testDistance = ( free + blocked ) // 2
+            axisOffset = horizontal and Point( sign * testDistance, 0 ) or Point( 0, sign * testDistance )
+
+            if self.collides( moveObject, curPos + axisOffset ):
+                blocked = testDistance
+            else:
+                free = testDistance
+
+        return sign * free
+
+
     # Implement the boundaries by collision.
     def getBoundedPosition( self, moveObject, newPos ):
         # Trigger collision events here? Or store on object?
@@ -279,45 +318,22 @@ class CollisionBoundary( Boundary ):
         curPos = moveObject.getPos()
         offsetPos = newPos - curPos
 
-        # First try to go up tight to the obstacle.
-        testPos = curPos + offsetPos / 2
-        event = self.collides( moveObject, testPos )
-
-        if not event:
-            return testPos
-
-        testPos = curPos + offsetPos / 3
-        event = self.collides( moveObject, testPos )
-
-        if not event:
-            return testPos
-
-        testPos = curPos + UnitPoint( offsetPos )
-        event = self.collides( moveObject, testPos )
-
-        if not event:
-            return testPos
+        # Go up tight to the obstacle horizontally, then slide along it vertically.
+        moveX = self.getFreeDistance( moveObject, curPos, offsetPos.x, True )
+        horizontalPos = curPos + Point( moveX, 0 )
+        moveY = self.getFreeDistance( moveObject, horizontalPos, offsetPos.y, False )
 
-        # Now check offset x and y separately.
-        if offsetPos.x:
-            horizontaltTestPos = curPos + Point( offsetPos.x, 0 )
-            event = self.collides( moveObject, horizontaltTestPos )
+        if moveX or moveY:
+            if moveX != offsetPos.x:
+                self.setBlockedHorizontally()
 
-            if not event:
+            if moveY != offsetPos.y:
                 self.setBlockedVertically()
-                # print( 'Allowed horizontal movement.' )
-                return horizontaltTestPos
 
-        if offsetPos.y:
-            verticalTestPos = curPos + Point( 0, offsetPos.y )
-            event = self.collides( moveObject, verticalTestPos )
-
-            if not event:
-                # print( 'Allowed vertical movement.' )
-                self.setBlockedHorizontally()
-                return verticalTestPos
+            return horizontalPos + Point( 0, moveY )
 
         self.setBlocked()
+        testPos = curPos + UnitPoint( offsetPos )
 
         if self.collidesWithSubSetFromCurrentPosition( moveObject, curPos, testPos ):
             # Accept newPos if current pos is already colliding.
@@ -349,6 +365,22 @@ class MovementStyle( object ):
         return False
 
 
+    # Whether the object can stop being moved until woken, because moving it wouldn't do anything.
+    # Only the built in styles known to stay put while not moving say so.
+    def canSleep( self ):
+        return False
+
+
+    def wakeMoveObject( self ):
+        if self.moveObject:
+            self.moveObject.wake()
+
+
+    # The furthest the object can move along either axis in one move.
+    def getMoveReach( self ):
+        return 0
+
+
     # Get the new position based on the movement style.
     def move( self, pos ):
         return pos
@@ -384,10 +416,12 @@ class GeneralMovementStyle( MovementStyle ):
 
     def setMovement( self, direction ):
         self.directions[direction] = True
+        self.wakeMoveObject()
 
 
     def reverseMovement( self, direction ):
         self.directions.reverseDirection( direction )
+        self.wakeMoveObject()
 
 
     def stopMovement( self, direction = None ):
@@ -416,6 +450,10 @@ class GeneralMovementStyle( MovementStyle ):
         return self.directions[direction]
 
 
+    def getMoveReach( self ):
+        return max( abs( self.moveRate.x ), abs( self.moveRate.y ) )
+
+
     def facing( self, direction = 'horizontal' ):
         return self.directions.facing( direction )
 
@@ -458,7 +496,7 @@ class GeneralMovementStyle( MovementStyle ):
     def postEvent( self, event ):
         if event:
             # print "Posting event " + `event`
-            pygame.event.post( event )
+            ge.eventBus.post( event )
 
 
     def sendEvent( self ):
@@ -501,6 +539,11 @@ class GeneralMovementStyle( MovementStyle ):
         return newPos
 
 
+    # Stays put while not moving, unless move() has been replaced.
+    def canSleep( self ):
+        return type( self ).move is GeneralMovementStyle.move and not self.moving()
+
+
     def adjustMoveOffset( self, offset ):
         if not self.moving( 'horizontal' ):
             offset.x = 0
@@ -559,6 +602,11 @@ class RandomWalkMovementStyle( GeneralMovementStyle ):
         super().__init__( **kwArgs )
 
 
+    # Decides whether to move every tick.
+    def canSleep( self ):
+        return False
+
+
     def decideMovement( self, multiplier = 1 ):
         rand = random.random()
 
@@ -0,0 +1,186 @@
+# Minitest Games
+# Game Events
+
+import game_constants as gc
+
+# Constants.
+
+GAME_EVENT_TYPES = ( gc.INTERACTION_EVENT, gc.COLLISION_EVENT, gc.CLICK_COLLISION_EVENT )
+
+
+
+
+# Game events are plain objects, with the same type and attributes as the pygame events they replace.
+class GameEvent( object ):
+    __slots__ = ()
+    type = None
+
+
+    # The attributes, as in pygame.event.Event.dict.
+    @property
+    def dict( self ):
+        return { name : getattr( self, name ) for name in self.__slots__ }
+
+
+    # The objects the event is about, for subscriber filters.
+    def getObjects( self ):
+        return ()
+
+
+    def __repr__( self ):
+        return '<%s(%s)>' % ( self.__class__.__name__, self.dict )
+
+
+
+
+class InteractionEvent( GameEvent ):
+    __slots__ = ( 'obj1', 'obj2', 'offset', 'point' )
+    type = gc.INTERACTION_EVENT
+
+
+    def __init__( self, obj1, obj2, offset, point ):
+        self.obj1 = obj1
+        self.obj2 = obj2
+        self.offset = offset
+        self.point = point
+
+
+    def getObjects( self ):
+        return ( self.obj1, self.obj2 )
+
+
+
+
+class CollisionEvent( GameEvent ):
+    __slots__ = ( 'obj1', 'obj2', 'collisionData', 'point', 'rect' )
+    type = gc.COLLISION_EVENT
+
+
+    def __init__( self, obj1, obj2, collisionData, point, rect ):
+        self.obj1 = obj1
+        self.obj2 = obj2
+        self.collisionData = collisionData
+        self.point = point
+        self.rect = rect
+
+
+    def getObjects( self ):
+        return ( self.obj1, self.obj2 )
+
+
+
+
+class ClickCollisionEvent( GameEvent ):
+    __slots__ = ( 'obj', 'pos' )
+    type = gc.CLICK_COLLISION_EVENT
+
+
+    def __init__( self, obj, pos ):
+        self.obj = obj
+        self.pos = pos
+
+
+    def getObjects( self ):
+        return ( self.obj, )
+
+
+
+
+class Subscriber( object ):
+    def __init__( self, callback, objType = None, name = None ):
+        self.callback = callback
+        self.objType = objType
+        self.name = name
+
+
+    # Filtered subscribers only get events about an object of the type and/or name.
+    def wants( self, event ):
+        objType = self.objType
+        name = self.name
+
+        if objType is None and name is None:
+            return True
+
+        for obj in event.getObjects():
+            if ( objType is None or isinstance( obj, objType ) ) and ( name is None or getattr( obj, 'name', None ) == name ):
+                return True
+
+        return False
+
+
+
+
+# Delivers game events to the callbacks subscribed to their type, in place of the pygame event queue.
+# Posted events are either dispatched straight away or, when batched, queued until flush() at the end of the tick.
+class EventBus( object ):
+    def __init__( self, batched = True ):
+        self.batched = batched
+        # Event type -> list of subscribers, in the order subscribed.
+        self._subscribers = {}
+        self._queue = []
+
+
+    def setBatched( self, batched = True ):
+        if not batched:
+            self.flush()
+
+        self.batched = batched
+
+
+    def subscribe( self, eventType, callback, objType = None, name = None ):
+        subscriber = Subscriber( callback, objType, name )
+        # Copied on change, so subscribing during dispatch doesn't affect the event being dispatched.
+        self._subscribers[eventType] = self._subscribers.get( eventType, [] ) + [ subscriber ]
+
+        return subscriber
+
+
+    def unsubscribe( self, eventType, subscriberOrCallback ):
+        subscribers = [ subscriber for subscriber in self._subscribers.get( eventType, [] )
+                        if subscriber is not subscriberOrCallback and subscriber.callback != subscriberOrCallback ]
+
+        if subscribers:
+            self._subscribers[eventType] = subscribers
+        else:
+            self._subscribers.pop( eventType, None )
+
+
+    def hasSubscribers( self, eventType ):
+        return eventType in self._subscribers
+
+
+    def post( self, event ):
+        if not event:
+            return
+
+        if self.batched:
+            self._queue.append( event )
+        else:
+            self.dispatch( event )
+
+
+    def dispatch( self, event ):
+        for subscriber in self._subscribers.get( event.type, () ):
+            if subscriber.wants( event ):
+                subscriber.callback( event )
+
+
+    # Dispatch the queued events, including any posted while doing so.
+    def flush( self ):
+        queue = self._queue
+        index = 0
+
+        while index < len( queue ):
+            self.dispatch( queue[index] )
+            index += 1
+
+        del queue[:]
+
+
+    def clear( self ):
+        del self._queue[:]
+
+
+
+
+eventBus = EventBus()
@@ -1,9 +1,14 @@
 # Minitest Games
 # Game Engine
 
-import pygame, copy
+import pygame, copy, bisect, collections
 import game_objects as go
 import game_utils as gu
+import game_spatial as gs
+import game_masks as gm
+import game_timers as gt
+import game_profiler as gp
+import game_events as ge
 from pygame.locals import *
 from geometry import *
 from game_constants import *
@@ -13,6 +18,10 @@ from game_constants import *
 
 # Temporary constant.
 DEFAULT_BACKGROUND_COLOUR = (211, 211, 211)
+# Static objects up to this draw order (Border, BackGround, SoftBackGround) are pre-rendered into the background layer.
+DEFAULT_BACKGROUND_LAYER_DRAW_ORDER = 1
+DEFAULT_BACKGROUND_CHUNK_SIZE = 512
+DEFAULT_MAX_BACKGROUND_CHUNKS = 64
 
 
 
@@ -21,7 +30,7 @@ def createInteractionEvent( obj1, obj2, interactionOffset ):
     # print( "Creating interaction event %s <-> %s" % ( obj1, obj2 ) )
     point = obj1.getOffSetPos( interactionOffset )
 
-    return pygame.event.Event( INTERACTION_EVENT, obj1=obj1, obj2=obj2, offset=interactionOffset, point=point )
+    return ge.InteractionEvent( obj1, obj2, interactionOffset, point )
 
 
 def createCollisionEvent( obj1, obj2, collisionData ):
@@ -29,12 +38,12 @@ def createCollisionEvent( obj1, obj2, collisionData ):
     point = obj1.getOffSetPos( collisionData.offset )
     rect = obj1.getOffSetOtherRect( collisionData.rect, collisionData.offset )
 
-    return pygame.event.Event( COLLISION_EVENT, obj1=obj1, obj2=obj2, collisionData=collisionData, point=point, rect=rect )
+    return ge.CollisionEvent( obj1, obj2, collisionData, point, rect )
 
 
 def createClickCollisionEvent( obj, pos ):
     # print( "Creating click collision event %s <-> %s" % ( obj, pos ) )
-    return pygame.event.Event( CLICK_COLLISION_EVENT, obj=obj, pos=pos )
+    return ge.ClickCollisionEvent( obj, pos )
 
 
 
@@ -96,43 +105,44 @@ class ImageStore( object ):
 
 
 
-class ObjectDrawSortKey:
-    def __init__( self, obj ):
-        self.obj = obj
-
-
-    def __lt__( self, other ):
-        return self.obj.drawOrder < other.obj.drawOrder or ( self.obj.drawOrder == other.obj.drawOrder and self.obj.colRect.centery < other.obj.colRect.centery )
-
-
-    def __eq__( self, other ):
-        return self.obj.drawOrder == other.obj.drawOrder and self.obj.colRect.bottom == other.obj.colRect.bottom
-
-
-    def __gt__( self, other ):
-        return self.obj.drawOrder > other.obj.drawOrder or ( self.obj.drawOrder == other.obj.drawOrder and self.obj.colRect.centery > other.obj.colRect.centery )
-
-
-    def __le__( self, other ):
-        return not ( self > other )
-
-
-    def __ge__( self, other ):
-        return not ( self < other )
-
-
-    def __ne__( self, other ):
-        return not ( self == other )
-
-
-
-
 class ObjectStore( object ):
-    def __init__( self, parentMap ):
+    def __init__( self, parentMap, cellSize = gs.DEFAULT_CELL_SIZE ):
         self.parentMap = parentMap
         self._objectLists = {}
         self._objectTypes = None
-        self._drawList = []
+        self._objectTypeRanks = None
+        # The objects, and their associated objects, kept in draw order as they move.
+        # Parallel lists of sort keys ( drawOrder, colRect.centery, tie break... ) and objects.
+        self._drawKeys = []
+        self._drawObjects = []
+        # Object id -> draw sort key.
+        self._drawKeyOfObject = {}
+        # Object id -> the associated objects drawn with it.
+        self._associatedDrawObjects = {}
+        # Spatial index of the draw bounds of the objects in the draw list, to only draw those in view.
+        self._drawHash = gs.SpatialHash( cellSize )
+        self.cellSize = cellSize
+        # Spatial indexes of object rectangles, one per InteractionType bit of the objects' properties,
+        # to limit collision tests to nearby objects that could possibly collide or interact.
+        self._propertyHashes = {}
+        # Object id -> object properties it is indexed under.
+        self._indexedProperties = {}
+        # Tester collision and interaction types -> property bits whose spatial indexes need searching.
+        self._typeMatrix = {}
+        # Spatial index of all objects' drawn rectangles, for picking objects by position.
+        self._pickHash = gs.SpatialHash( cellSize )
+        # Object id -> sequence number, to recover the object list order of spatial hash results.
+        self._objectSequence = {}
+        self._nextSequence = 0
+        # Nearby objects gathered once for the object currently moving, reused by all of its
+        # collision probes: [ moveObj, reach, rect, nearbyObjects, nearby dynamic objects from the broad-phase ].
+        self._nearbyObjectsCache = None
+        # Object id -> dynamic object, for the broad-phase at the start of each tick.
+        self._dynamicObjects = {}
+        # Object id -> ( rect, nearby dynamic objects ) found by the broad-phase for each dynamic object this tick.
+        self._preparedMoves = {}
+        # The camera ( x, y ) of the last update, when the asleep objects were last brought up to date.
+        self._updateCamera = None
 
 
     def getMap( self ):
@@ -156,9 +166,25 @@ class ObjectStore( object ):
 
 
     def addObject( self, obj, scene = None ):
+        self.resetNearbyObjectsCache()
+        self.resetPreparedMoves()
         self.getObjectList( obj, create=True ).append( obj )
-        self._drawList.append( obj )
+        self._objectSequence[id( obj )] = self._nextSequence
+        self._nextSequence += 1
         obj.setScene( scene )
+        obj.setObjectStore( self )
+        obj.wake()
+        # Ties in draw order are drawn in the order the objects were added.
+        self.insertDrawObject( obj, ( 0, self._objectSequence[id( obj )] ) )
+        self.associatedObjectsChanged( obj )
+        self.indexObject( obj )
+        self._pickHash.insert( obj, obj.rect )
+        obj.startLifetime()
+
+        if obj.isDynamic():
+            self._dynamicObjects[id( obj )] = obj
+        else:
+            self.staticObjectsChanged( obj )
 
         return obj
 
@@ -169,17 +195,129 @@ class ObjectStore( object ):
 
         if objList:
             objList.remove( obj )
-            self._drawList.remove( obj )
+            self.unindexObject( obj )
+
+
+    # Disabled objects and objects without properties can't collide or interact, so aren't indexed.
+    def indexObject( self, obj ):
+        objectProperties = obj.enabled and obj.objectProperties or go.InteractionType.NONE
+        self._indexedProperties[id( obj )] = objectProperties
+        propertyHashes = self._propertyHashes
+
+        for bit in go.InteractionType.ALL:
+            if objectProperties & bit:
+                spatialHash = propertyHashes.get( bit, None )
+
+                if spatialHash is None:
+                    propertyHashes[bit] = spatialHash = gs.SpatialHash( self.cellSize )
+
+                spatialHash.insert( obj, obj.maskBounds )
+
+
+    def removeFromPropertyHashes( self, obj ):
+        objectProperties = self._indexedProperties.pop( id( obj ), go.InteractionType.NONE )
+
+        for bit, spatialHash in self._propertyHashes.items():
+            if objectProperties & bit:
+                spatialHash.remove( obj )
+
+
+    def unindexObject( self, obj ):
+        self.resetNearbyObjectsCache()
+        self.resetPreparedMoves()
+        self.removeFromPropertyHashes( obj )
+        self._pickHash.remove( obj )
+        self.removeDrawObject( obj )
+
+        for associatedObject in self._associatedDrawObjects.pop( id( obj ), () ):
+            self.removeDrawObject( associatedObject )
+
+        self._objectSequence.pop( id( obj ), None )
+
+        if obj.objectStore is self:
+            obj.setObjectStore( None )
+
+        if obj.isDynamic():
+            self._dynamicObjects.pop( id( obj ), None )
+        else:
+            self.staticObjectsChanged( obj )
 
 
     def deleteAllObjectsOfType( self, objType ):
+        self.staticObjectsChanged()
         objLists = self._objectLists
 
         if objType in objLists:
+            for obj in objLists[objType]:
+                self.unindexObject( obj )
+
             del objLists[objType]
             self._objectTypes = None
 
 
+    # Called by objects when their position or size changes.
+    def objectMoved( self, obj ):
+        objectProperties = self._indexedProperties.get( id( obj ), go.InteractionType.NONE )
+
+        if objectProperties:
+            for bit, spatialHash in self._propertyHashes.items():
+                if objectProperties & bit:
+                    spatialHash.update( obj, obj.maskBounds )
+
+        cache = self._nearbyObjectsCache
+
+        # The moving object probing positions doesn't change what is near it, anything else might.
+        if cache and cache[0] is not obj:
+            self.resetNearbyObjectsCache()
+
+        if not obj.isDynamic():
+            self.staticObjectsChanged( obj )
+            self.resetPreparedMoves()
+        elif self._preparedMoves:
+            # Dynamic objects may move anywhere within the reach the broad-phase allowed them.
+            preparedMove = self._preparedMoves.get( id( obj ), None )
+
+            if not preparedMove or not preparedMove[0].contains( obj.maskBounds ):
+                self.resetPreparedMoves()
+
+
+    # Called by objects when their drawn rectangle is updated.
+    def objectRectChanged( self, obj ):
+        self._pickHash.update( obj, obj.rect )
+
+
+    # Called by objects when their enabled state, object properties or collision types change.
+    def objectChanged( self, obj ):
+        self.resetNearbyObjectsCache()
+        self.resetPreparedMoves()
+
+        if id( obj ) in self._indexedProperties:
+            self.removeFromPropertyHashes( obj )
+            self.indexObject( obj )
+
+        if not obj.isDynamic():
+            self.staticObjectsChanged( obj )
+
+
+    # Called when a static object is added, removed, moved or changed, or without one when any may have.
+    def staticObjectsChanged( self, obj = None ):
+        pass
+
+
+    def getStaticObjects( self ):
+        staticObjects = []
+
+        for objList in self._objectLists.values():
+            staticObjects.extend( obj for obj in objList if not obj.isDynamic() )
+
+        return staticObjects
+
+
+    # Can the test object be shown to not collide with any static object, without testing them individually.
+    def clearOfStaticCollisions( self, testObj ):
+        return False
+
+
 
     def prioritisedObjectTypes( self ):
         objectTypes = self._objectTypes
@@ -187,10 +325,159 @@ class ObjectStore( object ):
         if not objectTypes:
             objectTypes = list( self._objectLists.keys() )
             objectTypes.sort( key=lambda objectType : objectType.pickPriority, reverse=True )
+            self._objectTypes = objectTypes
+            self._objectTypeRanks = { objType : rank for rank, objType in enumerate( objectTypes ) }
 
         return objectTypes
 
 
+    # Sort objects into the same order as iterating the prioritised object type lists.
+    def sortByPriority( self, objects ):
+        self.prioritisedObjectTypes()
+        typeRanks = self._objectTypeRanks
+        objectSequence = self._objectSequence
+        objects.sort( key=lambda obj : ( typeRanks[obj.__class__], objectSequence[id( obj )] ) )
+
+        return objects
+
+
+    # Get the property bits that objects must have for the tester to collide or interact with them.
+    def getPropertyBits( self, testObj ):
+        testTypes = testObj.collisionTypes | testObj.interactionTypes
+        propertyBits = self._typeMatrix.get( testTypes, None )
+
+        if propertyBits is None:
+            propertyBits = tuple( bit for bit in go.InteractionType.ALL if testTypes & bit )
+            self._typeMatrix[testTypes] = propertyBits
+
+        return propertyBits
+
+
+    # Query only the spatial indexes of objects the tester could possibly collide or interact with.
+    # Returns a dictionary of id -> object.
+    def gatherNearbyObjects( self, testObj, rect ):
+        nearbyObjects = None
+        propertyHashes = self._propertyHashes
+
+        for bit in self.getPropertyBits( testObj ):
+            spatialHash = propertyHashes.get( bit, None )
+
+            if spatialHash is None:
+                continue
+
+            if nearbyObjects is None:
+                nearbyObjects = spatialHash.query( rect )
+            else:
+                nearbyObjects.update( spatialHash.query( rect ) )
+
+        return nearbyObjects or {}
+
+
+    def queryNearbyObjects( self, testObj, rect ):
+        nearbyObjects = self.gatherNearbyObjects( testObj, rect )
+
+        if not nearbyObjects:
+            return []
+
+        return self.sortByPriority( list( nearbyObjects.values() ) )
+
+
+    # Get the objects near the test object, or within the given rectangle, in priority order.
+    def getNearbyObjects( self, testObj, rect = None ):
+        if rect is None:
+            rect = testObj.maskBounds
+
+        cache = self._nearbyObjectsCache
+
+        if cache and cache[0] is testObj:
+            moveObj, reach, cacheRect, nearbyObjects, nearbyDynamicObjects = cache
+
+            if cacheRect and cacheRect.contains( rect ):
+                if nearbyObjects is None:
+                    # Left until the move first needs them, as many moves don't.
+                    cache[3] = nearbyObjects = self.getPreparedNearbyObjects( testObj, cacheRect, nearbyDynamicObjects )
+
+                return nearbyObjects
+
+            # Gather everything within reach of the move, for the probes that will follow.
+            cache[2] = rect = rect.inflate( 2 * reach + 4, 2 * reach + 4 )
+            cache[3] = nearbyObjects = self.queryNearbyObjects( testObj, rect )
+
+            return nearbyObjects
+
+        return self.queryNearbyObjects( testObj, rect )
+
+
+    # Collision queries for the moving object, until the end of the tick, gather the objects within reach
+    # of it once and then reuse them. Adding or removing objects or moving anything else starts again.
+    def beginMove( self, moveObj, reach ):
+        preparedMove = self._preparedMoves.get( id( moveObj ), None )
+
+        if preparedMove:
+            self._nearbyObjectsCache = [ moveObj, reach, preparedMove[0], None, preparedMove[1] ]
+        else:
+            self._nearbyObjectsCache = [ moveObj, reach, None, None, None ]
+
+
+    # The static objects within reach from the spatial indexes, the dynamic ones found by the broad-phase.
+    def getPreparedNearbyObjects( self, moveObj, rect, nearbyDynamicObjects ):
+        dynamicObjects = self._dynamicObjects
+        nearbyObjects = [ obj for objId, obj in self.gatherNearbyObjects( moveObj, rect ).items()
+                          if objId not in dynamicObjects and rect.colliderect( obj.maskBounds ) ]
+        nearbyObjects.extend( nearbyDynamicObjects )
+
+        return self.sortByPriority( nearbyObjects )
+
+
+    def resetNearbyObjectsCache( self ):
+        cache = self._nearbyObjectsCache
+
+        if cache:
+            cache[2] = None
+            cache[3] = None
+            cache[4] = None
+
+
+    # Broad-phase for a tick of movement. A single sort and sweep over the reach of every dynamic object finds
+    # the dynamic objects that could meet during their moves, wherever they move to within their reach.
+    # Static objects don't move, so are found from the spatial indexes as each object starts its move.
+    def prepareMoves( self ):
+        dynamicObjects = self._dynamicObjects
+        indexedProperties = self._indexedProperties
+        sweepEntries = []
+        sweptRects = {}
+
+        for objId, obj in dynamicObjects.items():
+            if obj.maskBounds is None:
+                continue
+
+            reach = obj.getMoveReach()
+            sweptRects[objId] = rect = obj.maskBounds.inflate( 2 * reach + 4, 2 * reach + 4 )
+            sweepEntries.append( gs.createSweepEntry( rect, obj ) )
+
+        overlaps = gs.sweepAndPrune( sweepEntries )
+        preparedMoves = {}
+
+        for objId, rect in sweptRects.items():
+            obj = dynamicObjects[objId]
+            testTypes = obj.collisionTypes | obj.interactionTypes
+            nearbyObjects = [ other for other in overlaps[objId]
+                              if indexedProperties.get( id( other ), go.InteractionType.NONE ) & testTypes ]
+            preparedMoves[objId] = ( rect, nearbyObjects )
+
+        self._preparedMoves = preparedMoves
+
+
+    def resetPreparedMoves( self ):
+        if self._preparedMoves:
+            self._preparedMoves = {}
+
+
+    def endTick( self ):
+        self._nearbyObjectsCache = None
+        self._preparedMoves = {}
+
+
     def objectsOfType( self, objType ):
         objLists = self._objectLists
 
@@ -213,22 +500,38 @@ class ObjectStore( object ):
 
 
 
+    # Objects asleep are skipped, unless the camera moved since the last update.
     def update( self, camera, updateOrder = None ):
         objLists = self._objectLists
+        cameraPos = camera.asTuple()
+        cameraMoved = cameraPos != self._updateCamera
+        self._updateCamera = cameraPos
 
         if not updateOrder:
             # Non-deterministic order.
             updateOrder = objLists.keys()
 
+        profiler = gp.profiler
+        profiling = profiler.isRecording()
+
         for objType in updateOrder:
             if objType not in objLists:
                 continue
                 # raise  AttributeError( "No objects of type '%s' in map!" % objType )
 
-            objList = objLists[objType]
+            if profiling:
+                with profiler.phase( 'update.%s' % objType.__name__ ):
+                    self.updateObjects( objLists[objType], camera, cameraMoved )
+            else:
+                self.updateObjects( objLists[objType], camera, cameraMoved )
 
-            for obj in objList:
+
+    def updateObjects( self, objList, camera, cameraMoved ):
+        for obj in objList:
+            if not obj.sleeping:
                 obj.update( camera )
+            elif cameraMoved:
+                obj.updateCamera( camera )
 
 
     # def move( self ):
@@ -251,25 +554,129 @@ class ObjectStore( object ):
             objList.sort( key=lambda obj : obj.colRect.bottom, reverse=reverse )
 
 
+    def getDrawKey( self, obj, tieBreak ):
+        return ( obj.drawOrder, obj.colRect.centery ) + tieBreak
+
+
+    def insertDrawObject( self, obj, tieBreak ):
+        drawKey = self.getDrawKey( obj, tieBreak )
+        index = bisect.bisect_right( self._drawKeys, drawKey )
+        self._drawKeys.insert( index, drawKey )
+        self._drawObjects.insert( index, obj )
+        self._drawKeyOfObject[id( obj )] = drawKey
+        self._drawHash.insert( obj, obj.getDrawBounds() )
+        obj.setDrawStore( self )
+
+
+    def removeDrawObject( self, obj ):
+        drawKey = self._drawKeyOfObject.pop( id( obj ), None )
+
+        if drawKey is None:
+            return
+
+        index = bisect.bisect_left( self._drawKeys, drawKey )
+        del self._drawKeys[index]
+        del self._drawObjects[index]
+        self._drawHash.remove( obj )
+
+        if obj.drawStore is self:
+            obj.setDrawStore( None )
+
+
+    # Called by objects when their draw order or drawn rectangle changes, to keep them in draw order.
+    def updateDrawOrder( self, obj ):
+        drawKey = self._drawKeyOfObject.get( id( obj ), None )
+
+        if drawKey is None:
+            return
+
+        tieBreak = drawKey[2:]
+
+        if drawKey != self.getDrawKey( obj, tieBreak ):
+            self.removeDrawObject( obj )
+            self.insertDrawObject( obj, tieBreak )
+        else:
+            self._drawHash.update( obj, obj.getDrawBounds() )
+
+
+    # Called by objects when their draw order or visibility changes.
+    def objectDrawChanged( self, obj ):
+        self.updateDrawOrder( obj )
+
+
+    # Called by objects when their attached objects have moved.
+    def updateDrawBounds( self, obj ):
+        if id( obj ) in self._drawKeyOfObject:
+            self._drawHash.update( obj, obj.getDrawBounds() )
+
+
+    # Called by objects when their associated objects change, which are drawn in order with the
+    # store's objects. Ties are drawn after all the store's objects, in their parents' order.
+    def associatedObjectsChanged( self, obj ):
+        objId = id( obj )
+
+        for associatedObject in self._associatedDrawObjects.pop( objId, () ):
+            self.removeDrawObject( associatedObject )
+
+        associatedObjects = list( obj.getAssociatedObjects() )
+
+        if associatedObjects:
+            self._associatedDrawObjects[objId] = associatedObjects
+
+            for associatedObject in associatedObjects:
+                self.insertDrawObject( associatedObject, ( 1, self._objectSequence[objId], self._nextSequence ) )
+                self._nextSequence += 1
+
+
+    # The objects and their associated objects in draw order. It is kept in order as objects move, not sorted.
     def getSortedDrawList( self ):
-        drawList = copy.copy( self._drawList )
+        return list( self._drawObjects )
 
-        for obj in self._drawList:
-            drawList.extend( obj.getAssociatedObjects() )
 
-        drawList.sort( key=lambda obj : ObjectDrawSortKey( obj ) ) #, reverse=reverse )
+    # The objects that could draw something within the world rectangle, in draw order.
+    def getVisibleDrawList( self, viewRect ):
+        visibleObjects = self._drawHash.query( viewRect )
 
-        return drawList
+        if 4 * len( visibleObjects ) > len( self._drawObjects ):
+            # Cheaper to pick them out of the draw list, which is already in order.
+            return [ obj for obj in self._drawObjects if id( obj ) in visibleObjects ]
+
+        drawKeyOfObject = self._drawKeyOfObject
+        visibleObjects = list( visibleObjects.values() )
+        visibleObjects.sort( key=lambda obj : drawKeyOfObject[id( obj )] )
+
+        return visibleObjects
 
 
     def draw( self, viewPort, debugDraw = False ):
-        drawList = self.getSortedDrawList()
-        surface = viewPort.surface
         viewRect = viewPort.getCameraRect()
+        drawList = self.getVisibleDrawList( viewRect )
+        self.drawObjects( viewPort.surface, viewRect, drawList, debugDraw=debugDraw or viewPort.debugDraw )
+
+
+    # Draw the objects in order, batching the blits of all but those that draw themselves differently.
+    def drawObjects( self, surface, viewRect, drawList, debugDraw = False ):
+        blitBatch = gu.BlitBatch( surface )
+        appendBlit = blitBatch.blits.append
 
         for obj in drawList:
-            # if type( obj ) is go.BackGround:
-            obj.draw( surface, viewRect )
+            if debugDraw:
+                obj.draw( surface, viewRect )
+            elif not obj.attachedObjects and obj.batchable:
+                # The common case of Object.addBlits(), inline.
+                if obj.visible and viewRect.colliderect( obj.rect ):
+                    appendBlit( ( obj.surface, obj.vpRect ) )
+            elif obj.isBatchable():
+                obj.addBlits( viewRect, blitBatch )
+            else:
+                blitBatch.flush()
+
+                if isinstance( surface, gu.RenderSnapshot ):
+                    obj.recordDraw( surface, viewRect )
+                else:
+                    obj.draw( surface, viewRect )
+
+        blitBatch.flush()
 
 
     def drawByObjectTypeOrder( self, viewPort, objTypes = None, debugDraw = False ):
@@ -298,68 +705,285 @@ class ObjectStore( object ):
                     obj.draw( viewPort.surface, viewRect )
 
 
-    def collides( self, testObj ):
+    # Candidates can be given to limit the test to objects already known to be nearby.
+    def collides( self, testObj, candidates = None ):
         event = None
-        objLists = self._objectLists
-        objTypes = self.prioritisedObjectTypes()
+        skipStatic = self.clearOfStaticCollisions( testObj )
 
-        for objType in objTypes:
-            objList = objLists[objType]
+        if candidates is None:
+            candidates = self.getNearbyObjects( testObj )
 
-            for obj in objList:
+        for obj in candidates:
+            if skipStatic and not obj.isDynamic():
+                collisionData = None
+            else:
                 collisionData = testObj.collidesWith( obj )
 
-                if collisionData:
-                    event = createCollisionEvent( testObj, obj, collisionData )
-                    break
-                else:
-                    interactionOffset = testObj.interactsWith( obj )
-
-                    if interactionOffset:
-                        event = createInteractionEvent( testObj, obj, interactionOffset )
-
-            if event and event.type == COLLISION_EVENT:
+            if collisionData:
+                event = createCollisionEvent( testObj, obj, collisionData )
                 break
+            else:
+                interactionOffset = testObj.interactsWith( obj )
+
+                if interactionOffset:
+                    event = createInteractionEvent( testObj, obj, interactionOffset )
 
         return event
 
 
-    def collidesWithPoint( self, pos, useFullRect = False ):
+    # Find the highest priority object at the given world position.
+    # With pixelPerfect, transparent parts of objects don't count.
+    def collidesWithPoint( self, pos, useFullRect = False, pixelPerfect = False ):
         event = None
-        objLists = self._objectLists
-        objTypes = self.prioritisedObjectTypes()
-
-        for objType in objTypes:
-            objList = objLists[objType]
+        nearbyObjects = self._pickHash.query( pygame.Rect( pos.x, pos.y, 1, 1 ) )
 
-            for obj in objList:
-                if obj.collidesWithPoint( pos, useFullRect=useFullRect ):
-                    event = createClickCollisionEvent( obj, pos )
-                    break
-
-            if event:
+        for obj in self.sortByPriority( list( nearbyObjects.values() ) ):
+            if obj.collidesWithPoint( pos, useFullRect=useFullRect, pixelPerfect=pixelPerfect ):
+                event = createClickCollisionEvent( obj, pos )
                 break
 
         return event
 
 
-    def getAllCollisions( self, testObj ):
+    def getAllCollisions( self, testObj, candidates = None ):
         collisionEvents = []
-        objLists = self._objectLists
-        objTypes = objLists.keys()
+        skipStatic = self.clearOfStaticCollisions( testObj )
 
-        for objType in objTypes:
-            objList = objLists[objType]
+        if candidates is None:
+            candidates = self.getNearbyObjects( testObj )
 
-            for obj in objList:
-                if testObj.collidesWith( obj ):
-                    collisionEvents.append( obj )
+        for obj in candidates:
+            if skipStatic and not obj.isDynamic():
+                continue
+
+            if testObj.collidesWith( obj ):
+                collisionEvents.append( obj )
 
         return collisionEvents
 
 
 
 
+# The static objects at the bottom of a scene's draw order, pre-rendered onto the background colour
+# in world space chunks. Chunks are rendered when they first come into view and reused while
+# scrolling, the least recently used being dropped when there are too many.
+class StaticBackGroundLayer( object ):
+    def __init__( self, maxDrawOrder = DEFAULT_BACKGROUND_LAYER_DRAW_ORDER, chunkSize = DEFAULT_BACKGROUND_CHUNK_SIZE,
+                  maxChunks = DEFAULT_MAX_BACKGROUND_CHUNKS ):
+        self.maxDrawOrder = maxDrawOrder
+        self.chunkSize = chunkSize
+        self.maxChunks = maxChunks
+        self.invalidate()
+
+
+    def invalidate( self ):
+        # The pre-rendered objects in draw order, or None when the layer needs building.
+        self._objects = None
+        self._objectIds = set()
+        # ( chunkX, chunkY ) -> chunk surface, or None if there is nothing in it.
+        self._chunks = collections.OrderedDict()
+        self._backGroundColour = None
+
+
+    def isValid( self ):
+        return self._objects is not None
+
+
+    def canPreRender( self, obj ):
+        return ( obj.visible and not obj.isDynamic() and obj.drawOrder <= self.maxDrawOrder
+                 and obj.positionStyle[:8] != 'viewport' and not obj.attachedObjects
+                 and obj.batchable )
+
+
+    def build( self, drawList ):
+        self.invalidate()
+        self._objects = [ obj for obj in drawList if self.canPreRender( obj ) ]
+        self._objectIds = { id( obj ) for obj in self._objects }
+
+
+    def isPreRendered( self, obj ):
+        return id( obj ) in self._objectIds
+
+
+    def renderChunk( self, chunkX, chunkY, surface ):
+        chunkSize = self.chunkSize
+        chunkRect = pygame.Rect( chunkX * chunkSize, chunkY * chunkSize, chunkSize, chunkSize )
+        chunk = None
+
+        for obj in self._objects:
+            if chunkRect.colliderect( obj.rect ):
+                if chunk is None:
+                    # The same pixel format as the surface drawn to.
+                    if isinstance( surface, gu.RenderSnapshot ):
+                        surface = surface.surface
+
+                    chunk = pygame.Surface( chunkRect.size, 0, surface )
+                    chunk.fill( self._backGroundColour )
+
+                chunk.blit( obj.surface, ( obj.rect.left - chunkRect.left, obj.rect.top - chunkRect.top ) )
+
+        return chunk
+
+
+    def draw( self, surface, viewRect, backGroundColour ):
+        if backGroundColour != self._backGroundColour:
+            self._chunks.clear()
+            self._backGroundColour = backGroundColour
+
+        chunkSize = self.chunkSize
+        chunks = self._chunks
+
+        for chunkY in range( viewRect.top // chunkSize, ( viewRect.bottom - 1 ) // chunkSize + 1 ):
+            for chunkX in range( viewRect.left // chunkSize, ( viewRect.right - 1 ) // chunkSize + 1 ):
+                chunkKey = ( chunkX, chunkY )
+
+                if chunkKey in chunks:
+                    chunks.move_to_end( chunkKey )
+                    chunk = chunks[chunkKey]
+                else:
+                    chunks[chunkKey] = chunk = self.renderChunk( chunkX, chunkY, surface )
+
+                    while len( chunks ) > self.maxChunks:
+                        chunks.popitem( last=False )
+
+                if chunk:
+                    surface.blit( chunk, ( chunkX * chunkSize - viewRect.left, chunkY * chunkSize - viewRect.top ) )
+
+
+
+
+# The collision masks of all the static objects in a scene combined into one tiled mask per
+# object property bit, so a moving object can check against all of them at once.
+# Static objects added, removed or changed only have the tiles under them redrawn.
+class StaticCollisionLayer( object ):
+    def __init__( self, tileSize = gm.DEFAULT_TILE_SIZE, cellSize = gs.DEFAULT_CELL_SIZE ):
+        self.tileSize = tileSize
+        self.cellSize = cellSize
+        self.invalidate()
+
+
+    def invalidate( self ):
+        # Property bit -> tiled mask covering bounds, or None when the layer needs building.
+        self._masks = None
+        self._bounds = None
+        self._propertyBits = go.InteractionType.NONE
+        # Object id -> world rectangle of the collision mask drawn, for the objects in the layer.
+        self._maskRects = {}
+        # Spatial index of the objects in the layer, to find those under a tile.
+        self._objectHash = gs.SpatialHash( self.cellSize )
+        # World rectangles whose tiles need redrawing.
+        self._dirtyRects = []
+
+
+    def isValid( self ):
+        return self._masks is not None
+
+
+    def includes( self, obj ):
+        return obj.enabled and obj.objectProperties and obj.getCollisionMask()
+
+
+    def addObject( self, obj ):
+        self._maskRects[id( obj )] = maskRect = pygame.Rect( obj.getMaskPos(), obj.getCollisionMask().get_size() )
+        self._objectHash.insert( obj, maskRect )
+
+        return maskRect
+
+
+    def build( self, objects ):
+        self.invalidate()
+        self._masks = masks = {}
+        objects = [ obj for obj in objects if self.includes( obj ) ]
+
+        if not objects:
+            return
+
+        maskRects = [ self.addObject( obj ) for obj in objects ]
+        self._bounds = bounds = maskRects[0].unionall( maskRects[1:] )
+
+        for obj in objects:
+            self._propertyBits |= obj.objectProperties
+
+        for bit in go.InteractionType.ALL:
+            if self._propertyBits & bit:
+                masks[bit] = gm.TiledMask( bounds.size, self.tileSize )
+
+        self._dirtyRects.append( bounds )
+
+
+    # Called when a static object is added, removed, moved or changed. Its tiles are redrawn
+    # before the next collision test, where it was and where it is now.
+    def objectChanged( self, obj, inScene ):
+        if not self.isValid():
+            return
+
+        maskRect = self._maskRects.pop( id( obj ), None )
+
+        if maskRect:
+            self._objectHash.remove( obj )
+            self._dirtyRects.append( maskRect )
+
+        if inScene and self.includes( obj ):
+            maskRect = self.addObject( obj )
+
+            if not self._bounds or not self._bounds.contains( maskRect ) or obj.objectProperties & ~self._propertyBits:
+                # Outside the masks the layer has, so start again.
+                self.invalidate()
+                return
+
+            self._dirtyRects.append( maskRect )
+
+
+    def redrawDirtyTiles( self ):
+        left, top = self._bounds.topleft
+        anyMask = next( iter( self._masks.values() ) )
+        tilePositions = set()
+
+        for rect in self._dirtyRects:
+            tilePositions.update( anyMask.getTilePositions( rect.move( -left, -top ) ) )
+
+        del self._dirtyRects[:]
+        maskRects = self._maskRects
+
+        for tileX, tileY in tilePositions:
+            tileRect = anyMask.getTileRect( tileX, tileY ).move( left, top )
+            objects = [ obj for obj in self._objectHash.query( tileRect ).values() if maskRects[id( obj )].colliderect( tileRect ) ]
+
+            for bit, mask in self._masks.items():
+                tileMask = pygame.mask.Mask( tileRect.size )
+
+                for obj in objects:
+                    if obj.objectProperties & bit:
+                        maskRect = maskRects[id( obj )]
+                        gm.drawMask( tileMask, obj.getCollisionMask(), ( maskRect.left - tileRect.left, maskRect.top - tileRect.top ) )
+
+                mask.setTile( tileX, tileY, tileMask )
+
+
+    # Could the test object collide with any of the static objects.
+    def collides( self, testObj ):
+        if self._dirtyRects:
+            self.redrawDirtyTiles()
+
+        testMask = testObj.getCollisionMask()
+        collisionTypes = testObj.collisionTypes
+        testX, testY = testObj.getMaskPos()
+
+        for bit, mask in self._masks.items():
+            if collisionTypes & bit:
+                # Only the tiles under the test mask, tested directly rather than cropped.
+                left = self._bounds.left - testX
+                top = self._bounds.top - testY
+
+                for tileX, tileY, tileMask in mask.getTiles( pygame.Rect( ( -left, -top ), testMask.get_size() ) ):
+                    if gm.overlap( testMask, tileMask, ( left + tileX, top + tileY ) ):
+                        return True
+
+        return False
+
+
+
+
 class Scene( ObjectStore ):
     @staticmethod
     def isScene( scene ):
@@ -370,6 +994,8 @@ class Scene( ObjectStore ):
         self.name = name
         self.backGroundColour = backGroundColour
         self.boundaryStyle = boundaryStyle
+        self.staticCollisionLayer = StaticCollisionLayer()
+        self.staticBackGroundLayer = StaticBackGroundLayer()
 
         super().__init__( parentMap )
 
@@ -390,6 +1016,40 @@ class Scene( ObjectStore ):
         return ObjectStore.addObject( self, obj, scene=self )
 
 
+    def staticObjectsChanged( self, obj = None ):
+        super().staticObjectsChanged( obj )
+        backGroundLayer = self.staticBackGroundLayer
+
+        if obj is None:
+            self.staticCollisionLayer.invalidate()
+            backGroundLayer.invalidate()
+        else:
+            self.staticCollisionLayer.objectChanged( obj, obj.objectStore is self )
+
+            if backGroundLayer.isPreRendered( obj ) or backGroundLayer.canPreRender( obj ):
+                backGroundLayer.invalidate()
+
+
+    def objectDrawChanged( self, obj ):
+        super().objectDrawChanged( obj )
+
+        if not obj.isDynamic():
+            self.staticBackGroundLayer.invalidate()
+
+
+    def clearOfStaticCollisions( self, testObj ):
+        if not testObj.isDynamic():
+            # Static objects are part of the layer, so would collide with themselves.
+            return False
+
+        staticCollisionLayer = self.staticCollisionLayer
+
+        if not staticCollisionLayer.isValid():
+            staticCollisionLayer.build( self.getStaticObjects() )
+
+        return not staticCollisionLayer.collides( testObj )
+
+
     # Called from Object only.
     def moveObjectToScene( self, obj, scene ):
         if not Scene.isScene( scene ):
@@ -403,7 +1063,39 @@ class Scene( ObjectStore ):
         # Draw the background.
         viewPort.drawBackGround( self.backGroundColour )
 
-        super().draw( viewPort )
+        if viewPort.debugDraw or not self.drawWithBackGroundLayer( viewPort ):
+            super().draw( viewPort )
+
+
+    # Draw the pre-rendered background layer and then the rest of the objects.
+    # Returns False if the objects need drawing individually.
+    def drawWithBackGroundLayer( self, viewPort ):
+        backGroundLayer = self.staticBackGroundLayer
+        surface = viewPort.surface
+        viewRect = viewPort.getCameraRect()
+        drawList = self.getVisibleDrawList( viewRect )
+
+        if not backGroundLayer.isValid():
+            backGroundLayer.build( self.getSortedDrawList() )
+
+        otherObjects = []
+
+        for obj in drawList:
+            if not backGroundLayer.isPreRendered( obj ):
+                # Anything else drawn at the layer's draw order would need to be drawn in between its objects.
+                if obj.drawOrder <= backGroundLayer.maxDrawOrder:
+                    return False
+
+                otherObjects.append( obj )
+            elif obj.attachedObjects:
+                backGroundLayer.invalidate()
+
+                return False
+
+        backGroundLayer.draw( surface, viewRect, self.backGroundColour )
+        self.drawObjects( surface, viewRect, otherObjects )
+
+        return True
 
 
     def collidesWithBoundary( self, obj ):
@@ -418,12 +1110,12 @@ class Scene( ObjectStore ):
         return collisionEvent
 
 
-    def collides( self, testObj ):
-        return super().collides( testObj ) or self.collidesWithBoundary( testObj )
+    def collides( self, testObj, candidates = None ):
+        return super().collides( testObj, candidates=candidates ) or self.collidesWithBoundary( testObj )
 
 
-    def getAllCollisions( self, testObj ):
-        collisionEvents = super().getAllCollisions( testObj )
+    def getAllCollisions( self, testObj, candidates = None ):
+        collisionEvents = super().getAllCollisions( testObj, candidates=candidates )
         boundaryCollisionEvent = self.collidesWithBoundary( testObj )
 
         if boundaryCollisionEvent:
@@ -445,6 +1137,14 @@ class Map( object ):
         self.images = None
         # self.drawOrder = None
         self.paused = False
+        # Timers in simulation steps, which stop while paused, and in real time milliseconds.
+        self.timers = gt.TimerWheel()
+        self.realTimers = gt.TimerWheel( gt.DEFAULT_REAL_TIME_RESOLUTION, pygame.time.get_ticks() )
+        # Where things were drawn before the last simulation step, for interpolation: camera ( x, y ) and
+        # object id -> ( object, viewport rectangle ). And what interpolateDrawPositions() replaced, to restore.
+        self._prevCamera = None
+        self._prevVpRects = {}
+        self._interpolated = None
 
 
     def setImageStore( self, images ):
@@ -508,6 +1208,15 @@ class Map( object ):
         return obj
 
 
+    # Removes the object from its scene or the overlays, but does not delete it.
+    def removeObject( self, obj ):
+        if obj.objectStore:
+            obj.objectStore.removeObject( obj )
+
+        if obj in self.movingObjects:
+            self.movingObjects.remove( obj )
+
+
     def addOverlay( self, obj ):
         self.overlays.addObject( obj )
 
@@ -562,21 +1271,179 @@ class Map( object ):
     def move( self ):
         # self.players.move()
         # self.sprites.move()
+        profiler = gp.profiler
+
+        if not self.paused:
+            with profiler.phase( 'move.prepare' ):
+                movingScenes = { id( moveObj.scene ) : moveObj.scene for moveObj in self.movingObjects if moveObj.scene }
+
+                for scene in movingScenes.values():
+                    scene.prepareMoves()
+
+        profiling = profiler.isRecording()
+
         for moveObj in self.movingObjects:
             if self.paused:
                 break
 
-            moveObj.move()
+            if profiling:
+                # By object type, which includes the collision checks.
+                with profiler.phase( 'move.%s' % moveObj.__class__.__name__ ):
+                    moveObj.move()
+            else:
+                moveObj.move()
+
+        with profiler.phase( 'move.timers' ):
+            if not self.paused:
+                self.timers.advance( self.timers.getTime() + 1 )
+
+            self.realTimers.advance( pygame.time.get_ticks() )
+
+        with profiler.phase( 'move.events' ):
+            ge.eventBus.flush()
+
+        self.endTick()
 
 
+    def endTick( self ):
+        scene = self.scene
+
+        for namedScene in self.scenes.values():
+            namedScene.endTick()
+
+            if namedScene is scene:
+                scene = None
+
+        # The default scene, or one changed to directly, isn't one of the named scenes.
+        if scene:
+            scene.endTick()
+
+
+    # The objects drawn within the world rectangle for the current scene and the overlays, including attached objects.
+    def getDrawnObjects( self, viewRect ):
+        self.ensureScene()
+        drawnObjects = self.scene.getVisibleDrawList( viewRect ) + self.overlays.getVisibleDrawList( viewRect )
+        index = 0
+
+        while index < len( drawnObjects ):
+            drawnObjects.extend( drawnObjects[index].attachedObjects )
+            index += 1
+
+        return drawnObjects
+
+
+    # Remember where everything in or near the view is drawn before a simulation step, to interpolate from.
+    # Half a view either side allows for the camera and objects moving into view during the step.
+    def saveDrawPositions( self, viewPort ):
+        viewRect = viewPort.getCameraRect()
+        viewRect.inflate_ip( viewRect.width, viewRect.height )
+        self._prevCamera = viewPort.camera.asTuple()
+        self._prevVpRects = { id( obj ) : ( obj, obj.vpRect ) for obj in self.getDrawnObjects( viewRect ) if obj.vpRect }
+
+
+    # Move the camera and everything drawn part way back to where they were before the last simulation step,
+    # where alpha is how far through the step to draw, from 0 at the start to 1 at the end.
+    # Must be followed by restoreDrawPositions() once drawn.
+    def interpolateDrawPositions( self, viewPort, alpha ):
+        if self._prevCamera is None or self._interpolated:
+            return
+
+        back = 1.0 - alpha
+        camera = viewPort.camera
+        prevCameraX, prevCameraY = self._prevCamera
+        # Rounded the same way as the rectangles, so everything stays lined up with the camera.
+        viewPort.camera = Point( camera.x + round( ( prevCameraX - camera.x ) * back ), camera.y + round( ( prevCameraY - camera.y ) * back ) )
+        prevVpRects = self._prevVpRects
+        interpolated = []
+
+        # Only what will be drawn from the interpolated camera.
+        for obj in self.getDrawnObjects( viewPort.getCameraRect() ):
+            vpRect = obj.vpRect
+            prevObj, prevVpRect = prevVpRects.get( id( obj ), ( None, None ) )
+
+            if not vpRect:
+                continue
+
+            if prevObj is obj:
+                if prevVpRect != vpRect:
+                    interpolated.append( ( obj, vpRect ) )
+                    obj.vpRect = vpRect.move( round( ( prevVpRect.left - vpRect.left ) * back ), round( ( prevVpRect.top - vpRect.top ) * back ) )
+            elif obj.positionStyle[:8] != 'viewport' and viewPort.camera.asTuple() != camera.asTuple():
+                # Not near the view before the step, so taken to have stayed put while the camera moved.
+                interpolated.append( ( obj, vpRect ) )
+                obj.vpRect = vpRect.move( camera.x - viewPort.camera.x, camera.y - viewPort.camera.y )
+
+        self._interpolated = ( viewPort, camera, interpolated )
+
+
+    def restoreDrawPositions( self ):
+        if not self._interpolated:
+            return
+
+        viewPort, camera, interpolated = self._interpolated
+        viewPort.camera = camera
+
+        for obj, vpRect in interpolated:
+            obj.vpRect = vpRect
+
+        self._interpolated = None
+
 
     def draw( self, viewPort ):
         self.ensureScene()
 
-        self.scene.draw( viewPort )
+        if viewPort.dirtyRectMode and not viewPort.debugDraw:
+            if self.drawDirtyRects( viewPort ):
+                return
+        else:
+            viewPort.invalidateDirtyRects()
+
+        with gp.profiler.phase( 'draw.scene' ):
+            self.scene.draw( viewPort )
+
         # self.sprites.draw( viewPort, objTypes )
         # self.players.draw( viewPort, objTypes )
-        self.overlays.draw( viewPort )
+        with gp.profiler.phase( 'draw.overlays' ):
+            self.overlays.draw( viewPort )
+
+
+    # Only clear and redraw the parts of the view that changed since the last frame.
+    # Returns False if the whole view needs drawing.
+    def drawDirtyRects( self, viewPort ):
+        scene = self.scene
+        surface = viewPort.surface
+        surfaceRect = surface.get_rect()
+        viewRect = viewPort.getCameraRect()
+        drawnList = []
+
+        for obj in scene.getVisibleDrawList( viewRect ) + self.overlays.getVisibleDrawList( viewRect ):
+            # What it draws could change without anything here changing.
+            if not obj.isDrawnRectsTracked():
+                viewPort.invalidateDirtyRects()
+
+                return False
+
+            drawnRects = obj.getDrawnRects( viewRect, surfaceRect, [] )
+
+            if drawnRects:
+                drawnList.append( ( obj, drawnRects ) )
+
+        dirtyRects = viewPort.findDirtyRects( drawnList, scene.getBackGroundColour() )
+
+        if dirtyRects is None:
+            return False
+
+        for dirtyRect in dirtyRects:
+            surface.set_clip( dirtyRect )
+            viewPort.drawBackGround( scene.getBackGroundColour() )
+
+            for obj, drawnRects in drawnList:
+                if dirtyRect.collidelist( [ rect for drawnSurface, rect in drawnRects ] ) != -1:
+                    obj.draw( surface, viewRect )
+
+        surface.set_clip( None )
+
+        return True
 
 
     def debugPos( self, name, pos, **kwArgs ):
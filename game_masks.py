@@ -0,0 +1,334 @@
+# Minitest Games
+# Game Masks
+
+import collections
+import pygame
+
+# Constants.
+
+DEFAULT_TILE_SIZE = 64
+DEFAULT_MASK_CACHE_SIZE = 256
+
+
+
+
+# A mask split into fixed size tiles, for large mostly empty or mostly solid images such as backgrounds.
+# Empty tiles aren't stored and full tiles share a single mask, so overlap tests only touch
+# the few stored tiles under the other mask.
+# Provides the parts of the pygame.mask.Mask interface used by the game objects, the rest
+# is provided by the overlap(), overlapMask() and drawMask() functions below.
+class TiledMask( object ):
+    # Full tile masks shared between all tiled masks, by tile size.
+    _sharedFullTiles = {}
+
+
+    @staticmethod
+    def fromSurface( surface, tileSize = DEFAULT_TILE_SIZE ):
+        tiledMask = TiledMask( surface.get_size(), tileSize )
+        width, height = tiledMask.get_size()
+
+        for tileY in range( 0, height, tileSize ):
+            for tileX in range( 0, width, tileSize ):
+                tileRect = pygame.Rect( tileX, tileY, tileSize, tileSize ).clip( surface.get_rect() )
+                tileMask = pygame.mask.from_surface( surface.subsurface( tileRect ) )
+                tiledMask.setTile( tileX, tileY, tileMask )
+
+        return tiledMask
+
+
+    @staticmethod
+    def isTiled( mask ):
+        return isinstance( mask, TiledMask )
+
+
+    def __init__( self, size, tileSize = DEFAULT_TILE_SIZE ):
+        self._size = tuple( size )
+        self.tileSize = tileSize
+        # Tile top left ( x, y ) -> tile mask, for tiles that aren't empty.
+        self._tiles = {}
+        # Tile top left ( x, y ) of the tiles that are completely full.
+        self._fullTiles = set()
+
+
+    def get_size( self ):
+        return self._size
+
+
+    # Get the number of ( empty, full, partially filled ) tiles.
+    def getTileCounts( self ):
+        tileSize = self.tileSize
+        width, height = self._size
+        numTiles = ( ( width + tileSize - 1 ) // tileSize ) * ( ( height + tileSize - 1 ) // tileSize )
+
+        return numTiles - len( self._tiles ), len( self._fullTiles ), len( self._tiles ) - len( self._fullTiles )
+
+
+    # Store a tile, dropping empty tiles and sharing full ones.
+    def setTile( self, tileX, tileY, tileMask ):
+        tileKey = ( tileX, tileY )
+        tileSize = tileMask.get_size()
+        count = tileMask.count()
+
+        if count == 0:
+            self._tiles.pop( tileKey, None )
+            self._fullTiles.discard( tileKey )
+        elif count == tileSize[0] * tileSize[1]:
+            fullTile = TiledMask._sharedFullTiles.get( tileSize, None )
+
+            if fullTile is None:
+                TiledMask._sharedFullTiles[tileSize] = fullTile = pygame.mask.Mask( tileSize, fill=True )
+
+            self._tiles[tileKey] = fullTile
+            self._fullTiles.add( tileKey )
+        else:
+            self._tiles[tileKey] = tileMask
+            self._fullTiles.discard( tileKey )
+
+
+    def getTileRect( self, tileX, tileY ):
+        return pygame.Rect( tileX, tileY, self.tileSize, self.tileSize ).clip( pygame.Rect( ( 0, 0 ), self._size ) )
+
+
+    # Get the top left ( x, y ) of every tile overlapping the rectangle, stored or not.
+    def getTilePositions( self, rect ):
+        rect = rect.clip( pygame.Rect( ( 0, 0 ), self._size ) )
+
+        if not rect.width or not rect.height:
+            return []
+
+        tileSize = self.tileSize
+
+        return [ ( tileX, tileY ) for tileY in range( rect.top - rect.top % tileSize, rect.bottom, tileSize )
+                                  for tileX in range( rect.left - rect.left % tileSize, rect.right, tileSize ) ]
+
+
+    # Get the stored tiles overlapping the rectangle, as ( tileX, tileY, tileMask ).
+    def getTiles( self, rect ):
+        rect = rect.clip( pygame.Rect( ( 0, 0 ), self._size ) )
+        tiles = []
+
+        if not rect.width or not rect.height:
+            return tiles
+
+        tileSize = self.tileSize
+        storedTiles = self._tiles
+        left = rect.left - rect.left % tileSize
+        top = rect.top - rect.top % tileSize
+
+        for tileY in range( top, rect.bottom, tileSize ):
+            for tileX in range( left, rect.right, tileSize ):
+                tileMask = storedTiles.get( ( tileX, tileY ), None )
+
+                if tileMask is not None:
+                    tiles.append( ( tileX, tileY, tileMask ) )
+
+        return tiles
+
+
+    def get_at( self, pos ):
+        x, y = pos
+        width, height = self._size
+
+        if not ( 0 <= x < width and 0 <= y < height ):
+            raise IndexError( "%s out of bounds" % ( pos, ) )
+
+        tileSize = self.tileSize
+        tileX = x - x % tileSize
+        tileY = y - y % tileSize
+        tileMask = self._tiles.get( ( tileX, tileY ), None )
+
+        return tileMask.get_at( ( x - tileX, y - tileY ) ) if tileMask is not None else 0
+
+
+    def count( self ):
+        return sum( tileMask.count() for tileMask in self._tiles.values() )
+
+
+    def get_bounding_rects( self ):
+        rects = []
+
+        for ( tileX, tileY ), tileMask in self._tiles.items():
+            rects.extend( rect.move( tileX, tileY ) for rect in tileMask.get_bounding_rects() )
+
+        return rects
+
+
+    # Copy the given rectangle of the mask into an ordinary mask of the rectangle's size.
+    def crop( self, rect ):
+        cropped = pygame.mask.Mask( rect.size )
+
+        for tileX, tileY, tileMask in self.getTiles( rect ):
+            cropped.draw( tileMask, ( tileX - rect.left, tileY - rect.top ) )
+
+        return cropped
+
+
+    # Draw (OR) an ordinary mask onto this one, in the same way as pygame.mask.Mask.draw().
+    def draw( self, mask, offset ):
+        offsetX, offsetY = offset
+        rect = pygame.Rect( offset, mask.get_size() ).clip( pygame.Rect( ( 0, 0 ), self._size ) )
+
+        if not rect.width or not rect.height:
+            return
+
+        tileSize = self.tileSize
+
+        for tileY in range( rect.top - rect.top % tileSize, rect.bottom, tileSize ):
+            for tileX in range( rect.left - rect.left % tileSize, rect.right, tileSize ):
+                if ( tileX, tileY ) in self._fullTiles:
+                    continue
+
+                tileMask = self._tiles.get( ( tileX, tileY ), None )
+
+                if tileMask is None:
+                    tileMask = pygame.mask.Mask( self.getTileRect( tileX, tileY ).size )
+                else:
+                    tileMask = tileMask.copy()
+
+                tileMask.draw( mask, ( offsetX - tileX, offsetY - tileY ) )
+                self.setTile( tileX, tileY, tileMask )
+
+
+    # Draw this mask onto an ordinary mask.
+    def drawOnto( self, mask, offset ):
+        offsetX, offsetY = offset
+        width, height = mask.get_size()
+
+        for tileX, tileY, tileMask in self.getTiles( pygame.Rect( -offsetX, -offsetY, width, height ) ):
+            mask.draw( tileMask, ( offsetX + tileX, offsetY + tileY ) )
+
+
+
+
+# Find the part of the first mask that could overlap the other.
+# Returns the region in the first mask's coordinates and the other mask and offset to test against it.
+def getOverlapRegion( mask, other, offset ):
+    region = pygame.Rect( ( 0, 0 ), mask.get_size() ).clip( pygame.Rect( offset, other.get_size() ) )
+
+    if not region.width or not region.height:
+        return None, None, None
+
+    offsetX, offsetY = offset
+
+    if TiledMask.isTiled( other ):
+        other = other.crop( region.move( -offsetX, -offsetY ) )
+        otherOffset = ( 0, 0 )
+    else:
+        otherOffset = ( offsetX - region.left, offsetY - region.top )
+
+    return region, other, otherOffset
+
+
+# The same as pygame.mask.Mask.overlap(), where either mask may be tiled.
+def overlap( mask, other, offset ):
+    if not TiledMask.isTiled( mask ):
+        if TiledMask.isTiled( other ):
+            # Only the part of the other mask under this one matters.
+            other = other.crop( pygame.Rect( ( -offset[0], -offset[1] ), mask.get_size() ) )
+            offset = ( 0, 0 )
+
+        return mask.overlap( other, offset )
+
+    region, other, otherOffset = getOverlapRegion( mask, other, offset )
+
+    if not region:
+        return None
+
+    overlapPos = mask.crop( region ).overlap( other, otherOffset )
+
+    if overlapPos:
+        overlapPos = ( overlapPos[0] + region.left, overlapPos[1] + region.top )
+
+    return overlapPos
+
+
+# The same as pygame.mask.Mask.overlap_mask(), where either mask may be tiled.
+# The result is tiled if the first mask is.
+def overlapMask( mask, other, offset ):
+    if not TiledMask.isTiled( mask ):
+        if TiledMask.isTiled( other ):
+            other = other.crop( pygame.Rect( ( -offset[0], -offset[1] ), mask.get_size() ) )
+            offset = ( 0, 0 )
+
+        return mask.overlap_mask( other, offset )
+
+    overlapTiles = TiledMask( mask.get_size(), mask.tileSize )
+    region, other, otherOffset = getOverlapRegion( mask, other, offset )
+
+    if region:
+        overlapTiles.draw( mask.crop( region ).overlap_mask( other, otherOffset ), region.topleft )
+
+    return overlapTiles
+
+
+# The same as pygame.mask.Mask.draw(), where either mask may be tiled.
+def drawMask( mask, other, offset ):
+    if TiledMask.isTiled( other ):
+        if TiledMask.isTiled( mask ):
+            for tileX, tileY, tileMask in other.getTiles( pygame.Rect( ( 0, 0 ), other.get_size() ) ):
+                mask.draw( tileMask, ( offset[0] + tileX, offset[1] + tileY ) )
+        else:
+            other.drawOnto( mask, offset )
+    else:
+        mask.draw( other, offset )
+
+
+
+
+# Masks and mask surfaces shared between objects with the same source images, size, collision area and
+# transparency mode, so that identical objects only build them once. The least recently used are
+# dropped when the cache is full, the objects using them keep their own references.
+# Cached masks and surfaces are shared, so must not be changed.
+class MaskCache( object ):
+    def __init__( self, maxEntries = DEFAULT_MASK_CACHE_SIZE ):
+        self.maxEntries = maxEntries
+        self.clear()
+
+
+    def clear( self ):
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__( self ):
+        return len( self._entries )
+
+
+    # Get the cached value for the key, creating it if necessary. A key of None means don't cache.
+    def get( self, key, create ):
+        if key is None:
+            return create()
+
+        entries = self._entries
+
+        if key in entries:
+            entries.move_to_end( key )
+            self.hits += 1
+
+            return entries[key]
+
+        self.misses += 1
+        entries[key] = value = create()
+
+        while len( entries ) > self.maxEntries:
+            entries.popitem( last=False )
+
+        return value
+
+
+    def setMaxEntries( self, maxEntries ):
+        self.maxEntries = maxEntries
+
+        while len( self._entries ) > maxEntries:
+            self._entries.popitem( last=False )
+
+
+
+
+# Get the transparency mode of a surface, which affects the masks made from it.
+def getTransparencyMode( surface ):
+    return ( surface.get_flags() & pygame.SRCALPHA, surface.get_colorkey() )
+
+
+maskCache = MaskCache()
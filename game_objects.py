@@ -1,12 +1,13 @@
 # Minitest Games
 # Game Objects
 
-import random, time, math, pygame, copy
+import random, time, math, pygame, copy, weakref
 import viewport
 from pygame.locals import *
 from geometry import *
 import game_utils as gu
 import game_constants as gc
+import game_masks as gm
 
 
 # Constants.
@@ -23,6 +24,8 @@ class InteractionType( object ):
     FOG = 32            # Doesn't collide with anything but can have some interaction.
     NEUTRINO = 64       # Very rarely interacts. Only with huge tanks of water.
 
+    ALL = ( IMPERVIOUS, HARD, SOLID, OVERLAY, GHOST, FOG, NEUTRINO )
+
 
 
 
@@ -155,6 +158,23 @@ class Object( object ):
     DEFAULT_OBJECT_SIZE = 20
 
     pickPriority = 2
+    # Whether draw() only blits the surface, so can be batched with other objects' blits. Worked out for
+    # each class from whether it draws itself, see __init_subclass__(), rather than set by hand.
+    batchable = True
+    # Whether getDrawnRects() changes whenever what draw() draws does, for dirty rectangle rendering. True for
+    # batchable classes, others have to say what their drawing depends on by overriding getDrawnRects().
+    drawnRectsTracked = True
+    # The transparent layer recordDraw() draws objects on, kept at the size of the frame.
+    _recordLayer = None
+    # Attributes that change what update() does, so wake the object.
+    WAKE_ATTRIBUTES = frozenset( ( 'size', 'ratio', 'positionStyle', 'updateCallback', '_collisionSpecification' ) )
+
+
+    # Classes with their own draw() or drawToSurface() draw more than their surface, so can't be batched.
+    def __init_subclass__( cls, **kwArgs ):
+        super().__init_subclass__( **kwArgs )
+        cls.batchable = cls.draw is Object.draw and cls.drawToSurface is Object.drawToSurface
+        cls.drawnRectsTracked = cls.batchable or cls.getDrawnRects is not Object.getDrawnRects
 
 
     # Constructor.
@@ -165,6 +185,10 @@ class Object( object ):
         # self.height = ( generalSize + random.randint( 0, 10 ) ) * multiplier
         self.parent = None
         self.scene = None
+        # The ObjectStore indexing this object, kept informed of position changes.
+        self.objectStore = None
+        # The ObjectStore drawing this object, or its parent for associated objects, kept informed of draw order changes.
+        self.drawStore = None
         self.name = kwArgs.get( 'name', None )
         self.visible = kwArgs.get( 'visible', True )
         self.enabled = kwArgs.get( 'enabled', True )
@@ -183,12 +207,22 @@ class Object( object ):
         # self.mirrorV = kwArgs.get( 'mirrorV', False )
         # self.mirrorH = kwArgs.get( 'mirrorH', False )
         self.updateCallback = kwArgs.get( 'updateCallback', None )
+        # Asleep objects aren't updated until something about them changes, see canSleep().
+        self.sleeping = False
+        # Simulation steps until the object removes itself, counted by the map's timers from when it's added.
         self.lifetime = kwArgs.get( 'lifetime', None )
+        self._lifetimeTimer = None
 
         # The object's world coordinate rectangle containing all of its shape.
         self.rect = None
         # The collision rectangle in world coordinates.
         self.colRect = None
+        # World coordinate bounds of the masks, kept current on every position change.
+        # Unlike rect and colRect these are used for collision, not drawing.
+        self.maskBounds = None
+        self.collisionBounds = None
+        # The collision area ( left, top, width, height ) relative to the top left of the collision mask.
+        self._collisionArea = None
         self._collisionSpecification = kwArgs.get( 'collisionSpecification', None )
         # The object's viewport coordinate rectangle.
         self.vpRect = None
@@ -232,10 +266,12 @@ class Object( object ):
 
     def setEnabled( self, enabled ):
         self.enabled = enabled
+        self.collisionPropertiesChanged()
 
 
     def toggleEnabled( self ):
         self.enabled = not self.enabled
+        self.collisionPropertiesChanged()
 
 
     def getCentre( self ):
@@ -251,16 +287,117 @@ class Object( object ):
         self.scene = scene
 
 
+    # Only call from ObjectStore.
+    def setObjectStore( self, objectStore ):
+        self.objectStore = objectStore
+
+
+    # Get the map the object is in, directly or attached to another object.
+    def getMap( self ):
+        obj = self
+
+        while obj.__dict__.get( 'parent', None ):
+            obj = obj.parent
+
+        objectStore = obj.__dict__.get( 'objectStore', None )
+
+        return objectStore.getMap() if objectStore else None
+
+
+    # Start the lifetime timers of the object and its attached objects, if not already started.
+    # Only once in a map, which counts the time.
+    def startLifetime( self ):
+        selfDict = self.__dict__
+
+        if selfDict.get( 'lifetime', None ) and not selfDict.get( '_lifetimeTimer', None ):
+            gameMap = self.getMap()
+
+            if gameMap:
+                self._lifetimeTimer = gameMap.timers.schedule( self.lifetime, self.expire )
+
+        for attachedObject in selfDict.get( 'attachedObjects', () ) + selfDict.get( 'associatedObjects', () ):
+            attachedObject.startLifetime()
+
+
+    def lifetimeChanged( self ):
+        lifetimeTimer = self.__dict__.get( '_lifetimeTimer', None )
+
+        if lifetimeTimer:
+            lifetimeTimer.cancel()
+            self._lifetimeTimer = None
+
+        self.startLifetime()
+
+
+    # Remove the object once its lifetime is up.
+    def expire( self ):
+        self._lifetimeTimer = None
+
+        if self.parent:
+            self.parent.detachObject( self )
+        else:
+            gameMap = self.getMap()
+
+            if gameMap:
+                gameMap.removeObject( self )
+
+
+    # Only call from ObjectStore.
+    def setDrawStore( self, drawStore ):
+        self.drawStore = drawStore
+
+
+    # Tell the draw store that the associated objects, drawn in order with the store's objects, have changed.
+    def associatedObjectsChanged( self ):
+        objectStore = self.__dict__.get( 'objectStore', None )
+
+        if objectStore:
+            objectStore.associatedObjectsChanged( self )
+
+
+    # Keep the mask bounds up to date and tell the object store the position or size has changed,
+    # to keep its spatial index up to date.
+    def positionChanged( self ):
+        selfDict = self.__dict__
+        selfDict['sleeping'] = False
+
+        if selfDict.get( '_collisionArea', None ) is None:
+            # Still being constructed.
+            return
+
+        self.updateBounds()
+        objectStore = selfDict.get( 'objectStore', None )
+
+        if objectStore:
+            objectStore.objectMoved( self )
+
+
+    # Tell the object store that what the object can collide or interact with has changed.
+    def collisionPropertiesChanged( self ):
+        objectStore = self.__dict__.get( 'objectStore', None )
+
+        if objectStore:
+            objectStore.objectChanged( self )
+
+
+    # Dynamic objects move themselves, everything else stays put unless explicitly moved.
+    def isDynamic( self ):
+        return False
+
+
     def setObjectProperties( self, objectProperties ):
         self.objectProperties = objectProperties
+        self.collisionPropertiesChanged()
 
 
     def setInteractionTypes( self, interactionTypes ):
         self.interactionTypes = interactionTypes
+        self.collisionPropertiesChanged()
 
 
     def setCollisionTypes( self, collisionTypes ):
         self.collisionTypes = collisionTypes
+        self.collisionPropertiesChanged()
 
 
     def mergeOverlayKwArgs( self, kwArgs ):
@@ -353,15 +490,41 @@ class Object( object ):
 
     def updateSurface( self, forceUpdateCollisionMask = False ):
         self.surface = self.getSurface()
-        self.interactionMask = pygame.mask.from_surface( self.surface )
+        self.interactionMask = gm.maskCache.get( self.getMaskCacheKey( 'interaction' ), lambda : self.createMask( self.surface ) )
 
         if forceUpdateCollisionMask or not self._staticCollisionMask:
             self.updateCollisionMask()
 
+        # The size may have changed.
+        self.positionChanged()
+
 
     def updateCollisionMask( self ):
-        self._collisionMaskSurface = self.getMaskSurface()
-        self._collisionMask = pygame.mask.from_surface( self._collisionMaskSurface )
+        self._collisionMaskSurface, self._collisionMask = gm.maskCache.get( self.getMaskCacheKey( 'collision' ), self.createCollisionMask )
+        self._collisionArea = self.getCollisionArea()
+
+
+    def createCollisionMask( self ):
+        maskSurface = self.getMaskSurface()
+
+        return maskSurface, self.createMask( maskSurface )
+
+
+    def createMask( self, surface ):
+        return pygame.mask.from_surface( surface )
+
+
+    # Get the key identifying the given mask type in the shared mask cache, or None if the object's
+    # masks can't be shared because its surface isn't made only from its images.
+    def getMaskCacheKey( self, maskType ):
+        return None
+
+
+    def updateBounds( self ):
+        maskX, maskY = self.getMaskPos()
+        areaLeft, areaTop, areaWidth, areaHeight = self._collisionArea
+        self.collisionBounds = pygame.Rect( maskX + areaLeft, maskY + areaTop, areaWidth, areaHeight )
+        self.maskBounds = pygame.Rect( ( maskX, maskY ), self.interactionMask.get_size() ).union( self.collisionBounds )
 
 
     def getPositionStyleOffset( self, camera = ORIGIN, offset = ORIGIN ):
@@ -384,6 +547,16 @@ class Object( object ):
         self.rect = self.getRect( camera, offset )
         self.vpRect = self.getViewportRect( camera, offset )
         self.colRect = self.getCollisionRect( self.rect )
+        selfDict = self.__dict__
+        objectStore = selfDict.get( 'objectStore', None )
+
+        if objectStore:
+            objectStore.objectRectChanged( self )
+
+        drawStore = selfDict.get( 'drawStore', None )
+
+        if drawStore:
+            drawStore.updateDrawOrder( self )
 
 
     # Get the object's surface top left (viewport) position given an offset
@@ -420,11 +593,18 @@ class Object( object ):
         return Rectangle( ul=offsetPos, width=self.width, height=self.height )
 
 
+    # Get the top left of the object's masks in integer world coordinates.
+    # Mask offsets are always calculated from these so that they agree between
+    # pairs of objects and combined masks.
+    def getMaskPos( self ):
+        return self.getOffSetPos().asTuple()
+
+
     def getRelativeOffset( self, obj ):
-        selfPos = self.getOffSetPos()
-        objPos = obj.getOffSetPos()
+        selfX, selfY = self.getMaskPos()
+        objX, objY = obj.getMaskPos()
 
-        return objPos - selfPos
+        return Point( objX - selfX, objY - selfY )
 
 
     def attachObject( self, obj, style = 'tight', pos = None ):
@@ -439,6 +619,7 @@ class Object( object ):
 
         if 'loose' == style or self.drawOrder != obj.drawOrder:
             self.associatedObjects.append( obj )
+            self.associatedObjectsChanged()
         else:
             self.attachedObjects.append( obj )
 
@@ -447,6 +628,9 @@ class Object( object ):
         if obj.positionStyle == '':
             obj.positionStyle = 'relative_centre'
 
+        obj.startLifetime()
+        self.wake()
+
         return obj
 
 
@@ -471,12 +655,15 @@ class Object( object ):
 
 
     def detachObject( self, obj ):
-        try:
-            obj.parent = None
+        if obj in self.attachedObjects:
             self.attachedObjects.remove( obj )
+        elif obj in self.associatedObjects:
             self.associatedObjects.remove( obj )
-        except ValueError:
-            obj = None
+            self.associatedObjectsChanged()
+        else:
+            return None
+
+        obj.parent = None
 
         return obj
 
@@ -497,6 +684,7 @@ class Object( object ):
         if includeAssociated:
             attachedObjectList.extend( self.associatedObjects )
             self.associatedObjects = []
+            self.associatedObjectsChanged()
 
         for obj in attachedObjectList:
             obj.parent = None
@@ -554,18 +742,19 @@ class Object( object ):
         return ( relLeft, relTop, colRect.width, colRect.height )
 
 
-    def getSceneCollisions( self ):
+    # Candidates optionally limits the test to a list of objects already known to be nearby.
+    def getSceneCollisions( self, candidates = None ):
         if not self.scene:
             return []
 
-        return self.scene.getAllCollisions( self )
+        return self.scene.getAllCollisions( self, candidates=candidates )
 
 
-    def collidesWithScene( self ):
+    def collidesWithScene( self, candidates = None ):
         if not self.scene:
             return None
 
-        event = self.scene.collides( self )
+        event = self.scene.collides( self, candidates=candidates )
 
         return event
 
@@ -658,8 +847,11 @@ class Object( object ):
 
 
     def collidesWithInteractionMask( self, obj ):
+        if not self.maskBounds.colliderect( obj.maskBounds ):
+            return None
+
         offset = self.getRelativeOffset( obj )
-        overlapOffset = self.interactionMask.overlap( obj.interactionMask, offset.asTuple() )
+        overlapOffset = gm.overlap( self.interactionMask, obj.interactionMask, offset.asTuple() )
 
         if overlapOffset:
             overlapOffset = Point( overlapOffset )
@@ -689,13 +881,16 @@ class Object( object ):
 
 
     def collidesWithCollisionMask( self, obj ):
+        if not self.collisionBounds.colliderect( obj.collisionBounds ):
+            return None
+
         offset = self.getRelativeOffset( obj ).asTuple()
-        overlapOffset = self._collisionMask.overlap( obj._collisionMask, offset )
+        overlapOffset = gm.overlap( self._collisionMask, obj._collisionMask, offset )
         collisionData = None
 
         if overlapOffset:
             overlapOffset = Point( overlapOffset ) # self.getOffSetPos() +
-            overlapMask = self._collisionMask.overlap_mask( obj._collisionMask, offset )
+            overlapMask = gm.overlapMask( self._collisionMask, obj._collisionMask, offset )
             overlapRect = self.getMaskRect( overlapMask, overlapOffset )
             collisionData = CollisionData( overlapOffset, overlapRect )
 
@@ -713,12 +908,14 @@ class Object( object ):
 
     def collidesWithColour( self, obj, useInteractionMask = False ):
         # Rect is now only used for drawing, not collision. It is not guaranteed to be in the right place.
+        # The collision mask test rejects non-overlapping collisionBounds first.
         # collides = self.collidesWithRect( obj )
         return self.collidesWithCollisionMask( obj )
 
 
     # Ask if the given world coordinate position collides with the object's full or collision rectangle.
-    def collidesWithPoint( self, pos, useFullRect = False ):
+    # With pixelPerfect the position must also be on a non-transparent pixel of the object.
+    def collidesWithPoint( self, pos, useFullRect = False, pixelPerfect = False ):
         if useFullRect:
             rect = self.rect
         else:
@@ -726,12 +923,24 @@ class Object( object ):
 
         collides = ( rect.left <= pos.x and pos.x <= rect.right ) and ( rect.top <= pos.y and pos.y <= rect.bottom )
 
+        if collides and pixelPerfect:
+            collides = self.collidesWithPixel( pos )
+
         # print( "collidesWithPoint %s %s %s" % ( pos, rect, collides ) )
         # print( "rect l %s r %s t %s b %s" % ( rect.left, rect.right, rect.top, rect.bottom ) )
 
         return collides
 
 
+    # Ask if the given world coordinate position is on a non-transparent pixel of the drawn object.
+    def collidesWithPixel( self, pos ):
+        x = int( pos.x - self.rect.left )
+        y = int( pos.y - self.rect.top )
+        width, height = self.interactionMask.get_size()
+
+        return 0 <= x < width and 0 <= y < height and 0 != self.interactionMask.get_at( ( x, y ) )
+
+
     # Deprecated. DON'T USE.
     # Does the object's foot position collide with the collision colour (default is a colour that is not the background colour).
     def collidesWithViewPortColour( self, viewPort, offset = ORIGIN, collisionColour = None ):
@@ -760,17 +969,30 @@ class Object( object ):
 
         self.updateRect( camera, offset )
         self.updateAttachedObjects( camera, offset )
-        self.checkLifetime()
+
+        if self.attachedObjects and self.drawStore:
+            self.drawStore.updateDrawBounds( self )
+
+        self.sleeping = self.canSleep()
 
 
-    # Need to convert this to real time based delay.
-    def checkLifetime( self ):
-        if self.lifetime:
-            self.lifetime -= 1
+    # Whether update() would do the same again, unless the camera moves or the object is woken.
+    # Only the built in update()s are known to, others may do something different every time.
+    def canSleep( self ):
+        return type( self ).update in SLEEPABLE_UPDATES and not ( self.updateCallback or self.attachedObjects or self.associatedObjects )
 
-            if self.lifetime <= 0:
-                self.parent.detachObject( self )
-                del self
+
+    def wake( self ):
+        self.sleeping = False
+
+
+    # Update an asleep object for a camera move, the same as update() would.
+    def updateCamera( self, camera ):
+        if self.positionStyle[:8] == 'viewport':
+            # Its world rectangle moves with the camera.
+            self.update( camera )
+        else:
+            self.vpRect = self.getViewportRect( camera )
 
 
     def updateAttachedObjects( self, camera = ORIGIN, offset = ORIGIN ):
@@ -805,6 +1027,92 @@ class Object( object ):
             self.drawAttachedObjects( surface, viewRect )
 
 
+    # Can draw() for the object and its attached objects be replaced by addBlits().
+    def isBatchable( self ):
+        if not self.batchable:
+            return False
+
+        for attachedObject in self.attachedObjects:
+            if not attachedObject.isBatchable():
+                return False
+
+        return True
+
+
+    # Add the blits draw() would do to a game_utils.BlitBatch. Only for batchable objects.
+    def addBlits( self, viewRect, blitBatch ):
+        if self.visible:
+            if viewRect.colliderect( self.rect ):
+                blitBatch.add( self.surface, self.vpRect )
+
+            for attachedObject in self.attachedObjects:
+                attachedObject.addBlits( viewRect, blitBatch )
+
+
+    # Record what draw() would draw in a game_utils.RenderSnapshot, for the render thread to draw later.
+    # The object is drawn now, onto a transparent layer blitted over the frame, so that nothing is left
+    # depending on its state when the frame is drawn. Drawing that blends with what is already on the
+    # surface comes out differently that way, so objects doing that should record their own drawing.
+    # Only the object's draw bounds are drawn, cleared and copied, of a layer shared between objects.
+    def recordDraw( self, snapshot, viewRect ):
+        # The bounds in viewport coordinates, with the object's own viewport rectangle for any bounce offset.
+        layerRect = self.getDrawBounds().move( -viewRect.left, -viewRect.top ).union( self.vpRect ).clip( snapshot.get_rect() )
+
+        if not layerRect.width or not layerRect.height:
+            return
+
+        layer = Object._recordLayer
+
+        if layer is None or layer.get_size() != snapshot.get_size():
+            Object._recordLayer = layer = pygame.Surface( snapshot.get_size(), pygame.SRCALPHA )
+
+        layer.set_clip( layerRect )
+        layer.fill( ( 0, 0, 0, 0 ) )
+        self.draw( layer, viewRect )
+        layer.set_clip( None )
+        # Copied, as the layer is drawn on again before the frame is.
+        snapshot.blit( layer.subsurface( layerRect ).copy(), layerRect )
+
+
+    # Add the ( surface, viewport rect ) of everything draw() would draw to drawnRects, for dirty rectangle rendering.
+    def getDrawnRects( self, viewRect, surfaceRect, drawnRects ):
+        if self.visible:
+            if viewRect.colliderect( self.rect ):
+                drawnRects.append( ( self.surface, self.getDrawnRect( surfaceRect ) ) )
+
+            for attachedObject in self.attachedObjects:
+                attachedObject.getDrawnRects( viewRect, surfaceRect, drawnRects )
+
+        return drawnRects
+
+
+    # Can dirty rectangle rendering tell from getDrawnRects() when the object and its attached objects need redrawing.
+    def isDrawnRectsTracked( self ):
+        if not self.drawnRectsTracked:
+            return False
+
+        for attachedObject in self.attachedObjects:
+            if not attachedObject.isDrawnRectsTracked():
+                return False
+
+        return True
+
+
+    # Get the part of the surface drawToSurface() changes.
+    def getDrawnRect( self, surfaceRect ):
+        return self.vpRect.copy()
+
+
+    # The world rectangle containing everything draw() draws, the object and its attached objects.
+    def getDrawBounds( self ):
+        drawBounds = self.rect
+
+        for attachedObject in self.attachedObjects:
+            drawBounds = drawBounds.union( attachedObject.getDrawBounds() )
+
+        return drawBounds
+
+
     def drawToSurface( self, surface ):
         vpRect = self.vpRect
 
@@ -876,8 +1184,25 @@ class Object( object ):
     def __setattr__( self, key, val ):
         if key == 'x':
             self.__dict__['pos'].x = val
+            self.positionChanged()
         elif key == 'y':
             self.__dict__['pos'].y = val
+            self.positionChanged()
+        elif key == 'pos':
+            self.__dict__['pos'] = val
+            self.positionChanged()
+        elif key == 'drawOrder' or key == 'visible':
+            self.__dict__[key] = val
+            drawStore = self.__dict__.get( 'drawStore', None )
+
+            if drawStore:
+                drawStore.objectDrawChanged( self )
+        elif key == 'lifetime':
+            self.__dict__[key] = val
+            self.lifetimeChanged()
+        elif key in Object.WAKE_ATTRIBUTES:
+            self.__dict__[key] = val
+            self.__dict__['sleeping'] = False
         else:
             self.__dict__[key] = val
 
@@ -897,6 +1222,8 @@ class ImageObject( Object ):
     def __init__( self, pos, image, **kwArgs ):
         self._image = image
         self._attachedText = None
+        # Split the masks into tiles of this size, for large images such as backgrounds.
+        self._maskTileSize = kwArgs.get( 'maskTileSize', None )
 
         kwArgs['ratio'] = self.calculateRatio( **kwArgs )
 
@@ -909,7 +1236,7 @@ class ImageObject( Object ):
 
         width = int( self.getWidth() )
         height = int( self.getHeight() )
-        surface = pygame.transform.scale( image, ( width, height ) )
+        surface = gu.surfaceCache.getScaled( image, ( width, height ) )
 
         # This prevents collision detection working properly for some reason.
         # It's not supposed to have any effect on per pixel alpha surfaces.
@@ -920,6 +1247,36 @@ class ImageObject( Object ):
         return surface
 
 
+    def createMask( self, surface ):
+        if self._maskTileSize:
+            return gm.TiledMask.fromSurface( surface, self._maskTileSize )
+
+        return super().createMask( surface )
+
+
+    # The images the collision mask is made from.
+    def getMaskImages( self ):
+        return ( self._image, )
+
+
+    # Masks are only shared when made from the images as they are, not when a subclass draws its own surface or masks.
+    def getMaskCacheKey( self, maskType ):
+        objType = type( self )
+
+        if objType.getSurface is not ImageObject.getSurface or objType.createMask is not ImageObject.createMask:
+            return None
+
+        image = self._image
+        key = ( maskType, self.surface.get_size(), self._maskTileSize, gm.getTransparencyMode( image ) )
+
+        if maskType == 'collision':
+            key += ( tuple( self.getMaskImages() ), self.getCollisionArea() )
+        else:
+            key += ( image, )
+
+        return key
+
+
     def getImage( self ):
         return self._image
 
@@ -1028,9 +1385,34 @@ class Fog( ImageObject ):
         kwArgs.setdefault( 'interactionTypes', InteractionType.NONE )
         kwArgs.setdefault( 'collisionTypes', InteractionType.NONE )
         kwArgs.setdefault( 'drawOrder', 8 )
+        # The composited fog, refilled when the fog's viewport rectangle, colour or surface changes.
+        self._fogLayer = None
+        self._fogLayerKey = None
+        # Fog layer -> the recorded frames still to draw it, which it can't be refilled for until they are drawn.
+        self._fogLayerFrames = {}
         super().__init__( pos, image, **kwArgs )
 
 
+    # Fog covers the whole surface.
+    def getDrawnRect( self, surfaceRect ): # override
+        return surfaceRect
+
+
+    # What the fog draws also depends on where its own rectangle is.
+    def getDrawnRects( self, viewRect, surfaceRect, drawnRects ): # override
+        super().getDrawnRects( viewRect, surfaceRect, drawnRects )
+
+        if self.visible and viewRect.colliderect( self.rect ):
+            drawnRects.append( ( self.surface, self.vpRect.copy() ) )
+
+        return drawnRects
+
+
+    # The fog layer isn't refilled while a recorded frame still has to draw it, so it can be recorded as it is.
+    def recordDraw( self, snapshot, viewRect ): # override
+        self.draw( snapshot, viewRect )
+
+
     def drawToSurface( self, surface ): # override
         vpRect = self.vpRect
         colour = self.surface.get_at( ( 0, 0 ) )
@@ -1056,11 +1438,39 @@ class Fog( ImageObject ):
             # Apparently only works for the display surface if it is not hardward accelerated.
             surface.blit( subSurface.convert(), clippedVpRect ) #, special_flags=BLEND_RGBA_MULT )
         else:
-            # The slow method. Fill a copy window surface with the fog colour and blit (draw) the smaller fog surface onto it with per pixel alpha.
-            fogSurface = surface.copy().convert_alpha() # This is neccessary for the fog to work.
-            fogSurface.fill( colour )
-            fogSurface.blit( self.surface, vpRect, special_flags=BLEND_RGBA_MULT )
-            surface.blit( fogSurface, ( 0, 0 ) )
+            # Fill a window sized surface with the fog colour and blit (draw) the smaller fog surface onto it with per pixel alpha.
+            # This only needs doing again when the fog moves relative to the view.
+            fogLayerKey = ( surface.get_size(), tuple( vpRect ), colour, self.surface )
+
+            if fogLayerKey != self._fogLayerKey:
+                fogSurface = self.getFreeFogLayer( surface.get_size() )
+                fogSurface.fill( colour )
+                fogSurface.blit( self.surface, vpRect, special_flags=BLEND_RGBA_MULT )
+                self._fogLayer = fogSurface
+                self._fogLayerKey = fogLayerKey
+
+            if isinstance( surface, gu.RenderSnapshot ):
+                self._fogLayerFrames[self._fogLayer].add( surface )
+
+            surface.blit( self._fogLayer, ( 0, 0 ) )
+
+
+    # Get a fog layer of the size that no recorded frame still has to draw, to refill.
+    # Only allocated when the size changes, or while the render thread is behind with recorded frames.
+    def getFreeFogLayer( self, size ):
+        fogLayerFrames = self._fogLayerFrames
+
+        for fogLayer, frames in list( fogLayerFrames.items() ):
+            if not frames:
+                if fogLayer.get_size() == size:
+                    return fogLayer
+
+                del fogLayerFrames[fogLayer]
+
+        fogLayer = pygame.Surface( size ).convert_alpha() # This is neccessary for the fog to work.
+        fogLayerFrames[fogLayer] = weakref.WeakSet()
+
+        return fogLayer
 
 
 
@@ -1145,13 +1555,18 @@ class Text( Object ):
     def __init__( self, pos, text, **kwArgs ):
         self.font = kwArgs.get( 'font', gu.fontCache['basic'] )
         self.text = text
+        # Build the text from cached character renders, for text that changes often.
+        self.renderGlyphs = kwArgs.get( 'renderGlyphs', False )
         self.mergeNonInteractingKwArgs( kwArgs )
 
         super().__init__( pos, **kwArgs )
 
 
     def getSurface( self ):
-        surface = self.font.render( self.text, True, self.colour )
+        if self.renderGlyphs:
+            surface = gu.fontCache.renderGlyphs( self.font, self.text, True, self.colour )
+        else:
+            surface = gu.fontCache.render( self.font, self.text, True, self.colour )
 
         # if self.scene:
         #     surface.set_colorkey( self.scene.backGroundColour )
@@ -1204,6 +1619,8 @@ class DynamicObject( ImageObject ):
         # Can't get property setter to work.
         self.steps = 0
         self._canMove = True
+        # Asleep movers aren't moved until woken, see MovementStyle.canSleep().
+        self.moveSleeping = False
         self._movementStyle = movementStyle
         self._images = self._determineImages( kwArgs )
         movementStyle.setMoveObject( self )
@@ -1226,6 +1643,14 @@ class DynamicObject( ImageObject ):
         return super().getMaskSurface( [ self.getSurface( image ) for image in self._images.asImageList() ] )
 
 
+    def getMaskImages( self ):
+        return self._images.asImageList()
+
+
+    def isDynamic( self ):
+        return True
+
+
     def toggleMovement( self ):
         self._canMove = not self._canMove
 
@@ -1254,10 +1679,18 @@ class DynamicObject( ImageObject ):
         self._movementStyle.adjustMoveOffset( offset )
 
 
+    def getMoveReach( self ):
+        return self._movementStyle.getMoveReach()
+
+
     def move( self ):
-        if not self._canMove:
+        if not self._canMove or self.moveSleeping:
             return
 
+        if self.scene:
+            # All the collision probes for this move, including the image swap, fall within reach.
+            self.scene.beginMove( self, self.getMoveReach() )
+
         newPos = self._movementStyle.move( self.pos )
 
         if newPos != self.pos:
@@ -1265,6 +1698,27 @@ class DynamicObject( ImageObject ):
             self.steps += 1
             # Updating the object image for the direction is another move, which needs collision detection.
             self.checkSwapImage( self._movementStyle.chooseImage( self._images ) )
+        elif self._movementStyle.canSleep():
+            # Nothing will move it until it's woken.
+            self.moveSleeping = True
+
+
+    def setPos( self, pos ):
+        super().setPos( pos )
+        self.moveSleeping = False
+
+
+    def wake( self ):
+        super().wake()
+        self.moveSleeping = False
+
+
+    def updateCamera( self, camera ):
+        if self.positionStyle[:8] == 'viewport':
+            self.update( camera )
+        else:
+            # With the same bounce offset as update().
+            self.vpRect = self.getViewportRect( camera, Point( 0, - self._movementStyle.getBounceAmount() ) )
 
 
     def update( self, camera = ORIGIN, offset = ORIGIN, gameOverMode = False, invulnerableMode = False ):
@@ -1293,6 +1747,12 @@ class DynamicObject( ImageObject ):
 
 
 
+# The update()s that can be slept through, see Object.canSleep().
+SLEEPABLE_UPDATES = ( Object.update, DynamicObject.update )
+
+
+
+
 class Sprite( DynamicObject ):
     def __init__( self, pos, movementStyle, **kwArgs ):
         kwArgs.setdefault( 'collisionSpecification', CollisionSpecification() )
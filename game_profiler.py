@@ -0,0 +1,221 @@
+# Minitest Games
+# Game Profiler
+
+import time, heapq, collections
+import pygame
+import game_utils as gu
+import game_constants as gc
+
+# Constants.
+
+DEFAULT_HISTORY_FRAMES = 300
+DEFAULT_PERCENTILES = ( 50, 95, 99 )
+DEFAULT_MAX_WORST_FRAMES = 5
+# Frames between refreshes of the overlay, so working it out doesn't take over the frames measured.
+DEFAULT_OVERLAY_INTERVAL = 30
+DEFAULT_OVERLAY_COLUMN_GAP = 12
+DEFAULT_PROFILE_FILE_NAME = 'profile.txt'
+
+
+
+
+# Times a phase of a frame, as a with statement.
+class ProfilePhase( object ):
+    def __init__( self, profiler, name ):
+        self.profiler = profiler
+        self.name = name
+
+
+    def __enter__( self ):
+        self.start = time.perf_counter()
+
+        return self
+
+
+    def __exit__( self, *excInfo ):
+        self.profiler.addTime( self.name, time.perf_counter() - self.start )
+
+
+
+
+# Does nothing, for phases while the profiler is off.
+class NullPhase( object ):
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *excInfo ):
+        pass
+
+
+
+
+# Records how long the phases of each frame take, over the last historyFrames frames, and the worst frames.
+# Phase names are dotted, eg. 'draw.map', and a phase's time includes the phases within it.
+# Per object type timings are phases too, eg. 'move.Sprite'.
+class FrameProfiler( object ):
+    _nullPhase = NullPhase()
+
+
+    def __init__( self, historyFrames = DEFAULT_HISTORY_FRAMES, maxWorstFrames = DEFAULT_MAX_WORST_FRAMES ):
+        self.enabled = False
+        self.showOverlay = True
+        self.historyFrames = historyFrames
+        self.maxWorstFrames = maxWorstFrames
+        self.overlayInterval = DEFAULT_OVERLAY_INTERVAL
+        self.clear()
+
+
+    def clear( self ):
+        # Phase name -> seconds, for each recorded frame.
+        self._frames = collections.deque( maxlen=self.historyFrames )
+        self._frame = None
+        self._frameStart = None
+        self._numFrames = 0
+        # A heap of ( seconds, frame number, phases ) for the slowest frames.
+        self._worstFrames = []
+        # The rendered report, redrawn every overlayInterval frames.
+        self._overlaySurface = None
+
+
+    def setEnabled( self, enabled = True ):
+        self.enabled = enabled
+
+        if not enabled:
+            self._frame = None
+
+
+    def toggle( self ):
+        self.setEnabled( not self.enabled )
+
+
+    def beginFrame( self ):
+        if self.enabled:
+            self._frame = collections.defaultdict( float )
+            self._frameStart = time.perf_counter()
+
+
+    def endFrame( self ):
+        frame = self._frame
+
+        if frame is None:
+            return
+
+        frameTime = time.perf_counter() - self._frameStart
+        frame['frame'] = frameTime
+        self._frames.append( frame )
+        self._numFrames += 1
+        self._frame = None
+        worstFrames = self._worstFrames
+
+        if len( worstFrames ) < self.maxWorstFrames:
+            heapq.heappush( worstFrames, ( frameTime, self._numFrames, frame ) )
+        elif frameTime > worstFrames[0][0]:
+            heapq.heapreplace( worstFrames, ( frameTime, self._numFrames, frame ) )
+
+        if self._numFrames % self.overlayInterval == 0:
+            self._overlaySurface = None
+
+
+    # Time a phase of the current frame: with profiler.phase( 'draw' ): ...
+    def phase( self, name ):
+        if self._frame is None:
+            return FrameProfiler._nullPhase
+
+        return ProfilePhase( self, name )
+
+
+    def addTime( self, name, seconds ):
+        frame = self._frame
+
+        if frame is not None:
+            frame[name] += seconds
+
+
+    def isRecording( self ):
+        return self._frame is not None
+
+
+    def getPhaseNames( self ):
+        names = set()
+
+        for frame in self._frames:
+            names.update( frame.keys() )
+
+        return sorted( names )
+
+
+    # Get ( average, percentile times..., worst ) in seconds for a phase over the recorded frames,
+    # counting frames without the phase as taking no time.
+    def getStats( self, name, percentiles = DEFAULT_PERCENTILES ):
+        times = sorted( frame.get( name, 0.0 ) for frame in self._frames )
+
+        if not times:
+            return None
+
+        stats = [ sum( times ) / len( times ) ]
+
+        for percentile in percentiles:
+            stats.append( times[min( len( times ) - 1, len( times ) * percentile // 100 )] )
+
+        stats.append( times[-1] )
+
+        return tuple( stats )
+
+
+    # Get the phase stats as rows of text, the first being the column headings, times in milliseconds.
+    def getReportTable( self, percentiles = DEFAULT_PERCENTILES ):
+        table = [ [ 'phase', 'avg' ] + [ 'p%d' % percentile for percentile in percentiles ] + [ 'max' ] ]
+
+        for name in self.getPhaseNames():
+            table.append( [ name ] + [ '%.2f' % ( seconds * 1000 ) for seconds in self.getStats( name, percentiles ) ] )
+
+        return table
+
+
+    # Get the report as a list of lines, times in milliseconds.
+    def getReport( self, percentiles = DEFAULT_PERCENTILES, includeWorstFrames = True ):
+        lines = [ '%d frames' % len( self._frames ) ]
+
+        for row in self.getReportTable( percentiles ):
+            lines.append( '%-24s' % row[0] + ''.join( ' %8s' % cell for cell in row[1:] ) )
+
+        if includeWorstFrames:
+            for frameTime, frameNumber, frame in sorted( self._worstFrames, reverse=True ):
+                phases = ', '.join( '%s %.2f' % ( name, frame[name] * 1000 ) for name in sorted( frame ) if name != 'frame' )
+                lines.append( 'frame %d: %.2f ms (%s)' % ( frameNumber, frameTime * 1000, phases ) )
+
+        return lines
+
+
+    def dump( self, fileName = DEFAULT_PROFILE_FILE_NAME ):
+        with open( fileName, 'w' ) as profileFile:
+            profileFile.write( '\n'.join( self.getReport() ) + '\n' )
+
+
+    # Draw the phase stats over the top left of the surface.
+    def drawOverlay( self, surface, font = 'small', colour = gc.WHITE, backGroundColour = gc.BLACK ):
+        if self._overlaySurface is None:
+            font = gu.fontCache.getFont( font )
+            # Rendered directly rather than through the font cache, as the text keeps changing.
+            renders = [ [ font.render( cell, True, colour ) for cell in row ] for row in self.getReportTable() ]
+            columnWidths = [ max( cells ) + DEFAULT_OVERLAY_COLUMN_GAP for cells in zip( *( [ render.get_width() for render in row ] for row in renders ) ) ]
+            lineHeight = font.get_linesize()
+            self._overlaySurface = overlaySurface = pygame.Surface( ( sum( columnWidths ), lineHeight * len( renders ) ) )
+            overlaySurface.fill( backGroundColour )
+
+            for rowIndex, row in enumerate( renders ):
+                # The phase names left aligned and the times right aligned.
+                right = 0
+
+                for columnIndex, render in enumerate( row ):
+                    right += columnWidths[columnIndex]
+                    left = 0 if columnIndex == 0 else right - DEFAULT_OVERLAY_COLUMN_GAP - render.get_width()
+                    overlaySurface.blit( render, ( left, rowIndex * lineHeight ) )
+
+        surface.blit( self._overlaySurface, ( 0, 0 ) )
+
+
+
+
+profiler = FrameProfiler()
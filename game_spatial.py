@@ -0,0 +1,171 @@
+# Minitest Games
+# Game Spatial Indexing
+
+# Constants.
+
+DEFAULT_CELL_SIZE = 128
+# Objects covering more cells than this are kept in a separate list and returned by every query.
+DEFAULT_MAX_CELLS_PER_OBJECT = 64
+
+
+
+
+# A uniform grid of cells, each holding the objects whose rectangle overlaps it.
+# Objects are keyed by id() because game objects are not hashable.
+class SpatialHash( object ):
+    def __init__( self, cellSize = DEFAULT_CELL_SIZE, maxCellsPerObject = DEFAULT_MAX_CELLS_PER_OBJECT ):
+        self.cellSize = cellSize
+        self.maxCellsPerObject = maxCellsPerObject
+        self.clear()
+
+
+    def clear( self ):
+        self._cells = {}
+        # Object id -> cell range ( left, top, right, bottom ), or None for large objects.
+        self._objectCells = {}
+        self._largeObjects = {}
+
+
+    def __len__( self ):
+        return len( self._objectCells )
+
+
+    def __contains__( self, obj ):
+        return id( obj ) in self._objectCells
+
+
+    def getCellRange( self, rect ):
+        cellSize = self.cellSize
+
+        # Grow by a pixel each side to allow for rounding of fractional positions.
+        return ( ( rect.left - 1 ) // cellSize, ( rect.top - 1 ) // cellSize,
+                 ( rect.right + 1 ) // cellSize, ( rect.bottom + 1 ) // cellSize )
+
+
+    def insert( self, obj, rect ):
+        objId = id( obj )
+        cellRange = self.getCellRange( rect )
+        left, top, right, bottom = cellRange
+
+        if ( right - left + 1 ) * ( bottom - top + 1 ) > self.maxCellsPerObject:
+            self._largeObjects[objId] = obj
+            self._objectCells[objId] = None
+            return
+
+        cells = self._cells
+
+        for cellX in range( left, right + 1 ):
+            for cellY in range( top, bottom + 1 ):
+                cell = cells.get( ( cellX, cellY ), None )
+
+                if cell is None:
+                    cells[( cellX, cellY )] = cell = {}
+
+                cell[objId] = obj
+
+        self._objectCells[objId] = cellRange
+
+
+    def remove( self, obj ):
+        objId = id( obj )
+
+        if objId not in self._objectCells:
+            return
+
+        cellRange = self._objectCells.pop( objId )
+
+        if cellRange is None:
+            del self._largeObjects[objId]
+            return
+
+        left, top, right, bottom = cellRange
+        cells = self._cells
+
+        for cellX in range( left, right + 1 ):
+            for cellY in range( top, bottom + 1 ):
+                cellKey = ( cellX, cellY )
+                cell = cells[cellKey]
+                del cell[objId]
+
+                if not cell:
+                    del cells[cellKey]
+
+
+    # Move an object to the cells under its new rectangle, doing nothing if they haven't changed.
+    def update( self, obj, rect ):
+        objId = id( obj )
+
+        if objId in self._objectCells:
+            cellRange = self._objectCells[objId]
+
+            if cellRange is not None and cellRange == self.getCellRange( rect ):
+                return
+
+            self.remove( obj )
+
+        self.insert( obj, rect )
+
+
+    # Return a dictionary of id -> object for all objects in cells overlapping the rectangle.
+    def query( self, rect ):
+        found = dict( self._largeObjects )
+        cells = self._cells
+        left, top, right, bottom = self.getCellRange( rect )
+
+        if ( right - left + 1 ) * ( bottom - top + 1 ) > len( cells ):
+            # Cheaper to check every occupied cell than every cell in the query.
+            for ( cellX, cellY ), cell in cells.items():
+                if left <= cellX <= right and top <= cellY <= bottom:
+                    found.update( cell )
+        else:
+            for cellX in range( left, right + 1 ):
+                for cellY in range( top, bottom + 1 ):
+                    cell = cells.get( ( cellX, cellY ), None )
+
+                    if cell:
+                        found.update( cell )
+
+        return found
+
+
+
+
+# A rectangle entry for sweepAndPrune.
+def createSweepEntry( rect, obj ):
+    return ( rect.left, rect.right, rect.top, rect.bottom, obj )
+
+
+# Sort sweep entries, in place, by their left edge.
+def sortSweepEntries( entries ):
+    entries.sort( key=lambda entry : entry[0] )
+
+    return entries
+
+
+# Find the pairs of overlapping entries by sorting them by their left edge and sweeping across them.
+# Entries that end before the current one starts are dropped from the active list while checking it.
+# Returns a dictionary of id( object ) -> list of the objects it overlaps.
+def sweepAndPrune( entries ):
+    overlaps = { id( entry[4] ) : [] for entry in entries }
+    activeEntries = []
+
+    for entry in sortSweepEntries( entries ):
+        left, right, top, bottom, obj = entry
+        objOverlaps = overlaps[id( obj )]
+        numActive = 0
+
+        for active in activeEntries:
+            if active[1] < left:
+                continue
+
+            activeEntries[numActive] = active
+            numActive += 1
+
+            if top <= active[3] and active[2] <= bottom:
+                objOverlaps.append( active[4] )
+                overlaps[id( active[4] )].append( obj )
+
+        del activeEntries[numActive:]
+        activeEntries.append( entry )
+
+    return overlaps
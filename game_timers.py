@@ -0,0 +1,161 @@
+# Minitest Games
+# Game Timers
+
+# Constants.
+
+# Bits of tick count covered by each level of a timer wheel, lowest first.
+# The lowest level has a slot per tick, each level above a slot per turn of the level below.
+WHEEL_BITS = ( 8, 6, 6, 6 )
+# Milliseconds per tick of a real time timer wheel.
+DEFAULT_REAL_TIME_RESOLUTION = 10
+
+
+
+
+class Timer( object ):
+    def __init__( self, wheel, tick, callback, args ):
+        self.wheel = wheel
+        # The wheel tick the timer expires on.
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.pending = True
+
+
+    def cancel( self ):
+        self.wheel.cancel( self )
+
+
+
+
+# A hierarchical timer wheel. Timers are kept in slots by the tick they expire on, so scheduling and
+# cancelling take constant time and advancing only touches the expiring timers, plus a share of the
+# occasional moves of timers down from the higher levels as their time gets nearer.
+# Time is in ticks of resolution units, eg. simulation steps or milliseconds.
+class TimerWheel( object ):
+    def __init__( self, resolution = 1, time = 0 ):
+        self.resolution = resolution
+        self._tick = int( time // resolution )
+        self._levels = [ [ [] for slot in range( 1 << bits ) ] for bits in WHEEL_BITS ]
+        # Timers in each level, including cancelled ones not yet dropped, for skipping empty stretches.
+        self._levelCounts = [ 0 ] * len( WHEEL_BITS )
+        # Timers too far off for the top level, added back each turn of it.
+        self._overflow = []
+        self._numPending = 0
+
+
+    def __len__( self ):
+        return self._numPending
+
+
+    def getTime( self ):
+        return self._tick * self.resolution
+
+
+    # Call callback( *args ) once the delay has passed. Returns the timer, for cancelling.
+    # Timers fire on the first tick after the delay, so never during the advance they're scheduled in.
+    def schedule( self, delay, callback, *args ):
+        ticks = max( 1, -int( -delay // self.resolution ) )
+        timer = Timer( self, self._tick + ticks, callback, args )
+        self.addTimer( timer )
+        self._numPending += 1
+
+        return timer
+
+
+    def cancel( self, timer ):
+        if timer and timer.pending:
+            # Left in its slot and dropped when reached.
+            timer.pending = False
+            self._numPending -= 1
+
+
+    # Put a timer in the slot for its tick, on the lowest level that reaches that far.
+    def addTimer( self, timer ):
+        ticks = timer.tick - self._tick
+        shift = 0
+
+        for levelIndex, bits in enumerate( WHEEL_BITS ):
+            if ticks < ( 1 << ( shift + bits ) ):
+                self._levels[levelIndex][( max( timer.tick, self._tick ) >> shift ) & ( ( 1 << bits ) - 1 )].append( timer )
+                self._levelCounts[levelIndex] += 1
+                return
+
+            shift += bits
+
+        self._overflow.append( timer )
+
+
+    # Move the timers in the current slot of a higher level down to the levels below.
+    # Returns True if the level above needs doing too, when this one has gone all the way round.
+    def cascade( self, levelIndex ):
+        shift = sum( WHEEL_BITS[:levelIndex] )
+        slotIndex = ( self._tick >> shift ) & ( ( 1 << WHEEL_BITS[levelIndex] ) - 1 )
+        slot = self._levels[levelIndex][slotIndex]
+        self._levels[levelIndex][slotIndex] = []
+        self._levelCounts[levelIndex] -= len( slot )
+
+        for timer in slot:
+            if timer.pending:
+                self.addTimer( timer )
+
+        return slotIndex == 0
+
+
+    # Fire all the timers due up to the time.
+    def advance( self, time ):
+        endTick = int( time // self.resolution )
+        lowest = self._levels[0]
+        lowestMask = len( lowest ) - 1
+        levelCounts = self._levelCounts
+
+        while self._tick < endTick:
+            if not self._numPending:
+                # Nothing to fire on the way.
+                self._tick = endTick
+                break
+
+            nextTick = self._tick + 1
+
+            if not levelCounts[0]:
+                # Skip to the next time a level with timers in moves them down.
+                levelIndex = 1
+
+                while levelIndex < len( levelCounts ) and not levelCounts[levelIndex]:
+                    levelIndex += 1
+
+                shift = sum( WHEEL_BITS[:levelIndex] )
+                nextTick = ( ( self._tick >> shift ) + 1 ) << shift
+
+                if nextTick > endTick:
+                    self._tick = endTick
+                    break
+
+            self._tick = nextTick
+            slotIndex = nextTick & lowestMask
+
+            if slotIndex == 0:
+                levelIndex = 1
+
+                while levelIndex < len( self._levels ) and self.cascade( levelIndex ):
+                    levelIndex += 1
+
+                if levelIndex == len( self._levels ):
+                    overflow = self._overflow
+                    self._overflow = []
+
+                    for timer in overflow:
+                        if timer.pending:
+                            self.addTimer( timer )
+
+            slot = lowest[slotIndex]
+
+            if slot:
+                lowest[slotIndex] = []
+                levelCounts[0] -= len( slot )
+
+                for timer in slot:
+                    if timer.pending:
+                        timer.pending = False
+                        self._numPending -= 1
+                        timer.callback( *timer.args )
@@ -1,13 +1,31 @@
 # Minitest Games
 # Game Utilities
 
-import sys, copy
+import sys, copy, collections
 import pygame
 
 
+# Constants.
+
+DEFAULT_SURFACE_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_TEXT_RENDERS = 512
+DEFAULT_MAX_GLYPH_RENDERS = 1024
+
+
+# Fonts by id, and renders of text in them. Rendered text surfaces are shared, so must not be drawn on.
 class FontCache( object ):
-    def __init__( self ):
+    def __init__( self, maxRenders = DEFAULT_MAX_TEXT_RENDERS, maxGlyphs = DEFAULT_MAX_GLYPH_RENDERS ):
         self.fonts = {}
+        self.maxRenders = maxRenders
+        self.maxGlyphs = maxGlyphs
+        self.clearRenders()
+
+
+    def clearRenders( self ):
+        # ( font, text, antialias, colour ) -> surface, least recently used first.
+        self._renders = collections.OrderedDict()
+        # ( font, character, antialias, colour ) -> surface, least recently used first.
+        self._glyphs = collections.OrderedDict()
 
 
     def addFont( self, fontId, fontName, size ):
@@ -29,6 +47,110 @@ class FontCache( object ):
         self.fonts[fontId] = font
 
 
+    # Fonts can be given by id or as the font itself.
+    def getFont( self, font ):
+        if isinstance( font, str ):
+            font = self[font]
+
+        return font
+
+
+    # Render the text, reusing an earlier render of the same text.
+    def render( self, font, text, antialias, colour ):
+        font = self.getFont( font )
+
+        return getCachedRender( self._renders, self.maxRenders, ( font, text, antialias, tuple( colour ) ),
+                                lambda : font.render( text, antialias, colour ) )
+
+
+    # Render the text by joining renders of its characters, so that only characters not seen before are
+    # rendered, keeping the joined text too. There is no kerning between characters, so the result can
+    # differ from render() by a pixel or so of spacing, and joining is slower than rendering the whole
+    # text, so it only helps fonts that are slow to render.
+    def renderGlyphs( self, font, text, antialias, colour ):
+        font = self.getFont( font )
+
+        if not text:
+            return self.render( font, text, antialias, colour )
+
+        colourKey = tuple( colour )
+
+        return getCachedRender( self._renders, self.maxRenders, ( font, text, antialias, colourKey, 'glyphs' ),
+                                lambda : self.joinGlyphs( font, text, antialias, colour ) )
+
+
+    def joinGlyphs( self, font, text, antialias, colour ):
+        colourKey = tuple( colour )
+        glyphs = [ getCachedRender( self._glyphs, self.maxGlyphs, ( font, character, antialias, colourKey ),
+                                    lambda : font.render( character, antialias, colour ) ) for character in text ]
+        width = sum( glyph.get_width() for glyph in glyphs )
+        height = max( glyph.get_height() for glyph in glyphs )
+        surface = pygame.Surface( ( width, height ), pygame.SRCALPHA )
+        x = 0
+
+        for glyph in glyphs:
+            # Keep the glyphs' own colour and alpha where they overhang each other, rather than blending.
+            surface.blit( glyph, ( x, 0 ), special_flags=pygame.BLEND_RGBA_MAX )
+            x += glyph.get_width()
+
+        return surface
+
+
+
+# Scaled copies of source surfaces, shared by all objects using the same image at the same size.
+# The least recently used are dropped when the surfaces take more than maxBytes.
+# Cached surfaces are shared, so must not be drawn on.
+class SurfaceCache( object ):
+    def __init__( self, maxBytes = DEFAULT_SURFACE_CACHE_BYTES ):
+        self.maxBytes = maxBytes
+        self.clear()
+
+
+    def clear( self ):
+        self._surfaces = collections.OrderedDict()
+        self.numBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__( self ):
+        return len( self._surfaces )
+
+
+    def setMaxBytes( self, maxBytes ):
+        self.maxBytes = maxBytes
+        self.evict()
+
+
+    def getScaled( self, surface, size ):
+        size = ( int( size[0] ), int( size[1] ) )
+        # The key keeps a reference to the source surface, so its id can't be reused.
+        key = ( surface, size )
+        surfaces = self._surfaces
+
+        if key in surfaces:
+            surfaces.move_to_end( key )
+            self.hits += 1
+
+            return surfaces[key]
+
+        self.misses += 1
+        surfaces[key] = scaledSurface = pygame.transform.scale( surface, size )
+        self.numBytes += getSurfaceBytes( scaledSurface )
+        self.evict()
+
+        return scaledSurface
+
+
+    def evict( self ):
+        surfaces = self._surfaces
+
+        # Always keep the latest, even if it is bigger than the budget.
+        while self.numBytes > self.maxBytes and len( surfaces ) > 1:
+            key, scaledSurface = surfaces.popitem( last=False )
+            self.numBytes -= getSurfaceBytes( scaledSurface )
+
+
 
 def debugPrintSurface( surface ):
     width, height = surface.get_size()
@@ -106,6 +228,103 @@ def fillSurfaceMinusRectangle( surface, rect, colour ):
         surface.fill( colour, fillRect )
 
 
+# Collects blits to a surface and does them with a single Surface.blits() call.
+# Anything drawn to the surface directly must flush the batch first, to keep the drawing order.
+class BlitBatch( object ):
+    def __init__( self, surface ):
+        self.surface = surface
+        # The ( source, dest ) pairs to blit. Only ever cleared in place, so can be appended to directly.
+        self.blits = []
+
+
+    def __len__( self ):
+        return len( self.blits )
+
+
+    def add( self, source, dest ):
+        self.blits.append( ( source, dest ) )
+
+
+    def flush( self ):
+        if self.blits:
+            self.surface.blits( self.blits, doreturn=False )
+            del self.blits[:]
+
+
+
+
+# A record of the drawing done for one frame, standing in for the surface drawn to, so that the
+# frame can be drawn later on another thread by render(). Provides the parts of the pygame.Surface
+# interface used when drawing the map without debug drawing.
+# The recorded surfaces and rectangles are only ever replaced by the game objects, not changed, so
+# the record stays valid while the game carries on. Objects that draw themselves differently record
+# surfaces drawn for the frame, see Object.recordDraw(), so rendering only ever fills and blits.
+class RenderSnapshot( object ):
+    def __init__( self, surface ):
+        # The surface the frame is for, only used for its size and pixel format.
+        self.surface = surface
+        self._rect = surface.get_rect()
+        # ( drawFunction, args ) in drawing order.
+        self._ops = []
+
+
+    def get_size( self ):
+        return self._rect.size
+
+
+    def get_rect( self ):
+        return self._rect.copy()
+
+
+    def fill( self, colour, rect = None ):
+        self._ops.append( ( RenderSnapshot.drawFill, ( colour, rect and pygame.Rect( rect ) ) ) )
+
+
+    def blit( self, source, dest ):
+        self._ops.append( ( RenderSnapshot.drawBlits, ( [ ( source, dest ) ], ) ) )
+
+
+    def blits( self, blitSequence, doreturn = True ):
+        # Copied, as blit batches are reused.
+        self._ops.append( ( RenderSnapshot.drawBlits, ( list( blitSequence ), ) ) )
+
+
+    @staticmethod
+    def drawFill( surface, colour, rect ):
+        surface.fill( colour, rect )
+
+
+    @staticmethod
+    def drawBlits( surface, blitSequence ):
+        surface.blits( blitSequence, doreturn=False )
+
+
+    # Draw the recorded frame to a surface the same size and format as the original.
+    def render( self, surface ):
+        for drawFunction, args in self._ops:
+            drawFunction( surface, *args )
+
+
+
+# Get a render from an LRU cache dictionary, rendering it if necessary.
+def getCachedRender( renders, maxRenders, key, render ):
+    if key in renders:
+        renders.move_to_end( key )
+
+        return renders[key]
+
+    renders[key] = surface = render()
+
+    while len( renders ) > maxRenders:
+        renders.popitem( last=False )
+
+    return surface
+
+
+def getSurfaceBytes( surface ):
+    return surface.get_pitch() * surface.get_height()
+
+
 # Create a copy of a surface (image display object) filled by the transparent colour.
 def createTransparentSurfaceCopy( surface ):
     # width, height = surface.get_size()
@@ -122,3 +341,4 @@ def createTransparentSurfaceCopy( surface ):
 
 
 fontCache = FontCache()
+surfaceCache = SurfaceCache()
@@ -1,10 +1,11 @@
 # Minitest Games
 # ViewPort
 
-import random, pygame, copy, os
+import random, pygame, copy, os, threading
 from pygame.locals import *
 from geometry import *
 import game_utils as gu
+import game_events as ge
 import game_constants as gc
 
 
@@ -13,6 +14,10 @@ import game_constants as gc
 DEFAULT_BACKGROUND_COLOUR = gc.WHITE
 # How far from the center the player moves before moving the camera.
 DEFAULT_CAMERASLACK = 90
+# Dirty rectangle rendering redraws everything when more than this many rectangles
+# or this fraction of the view changes.
+MAX_DIRTY_RECTS = 32
+MAX_DIRTY_AREA_FRACTION = 0.5
 
 
 
@@ -20,6 +25,8 @@ DEFAULT_CAMERASLACK = 90
 class ViewPort( object ):
     # Class variables.
     debugDraw = False
+    # Headless viewports have no real display, so games run without frame rate limiting.
+    headless = False
 
 
     @staticmethod
@@ -55,6 +62,14 @@ class ViewPort( object ):
         self.camera = Point( 0, 0 )
         self.cameraSlack = DEFAULT_CAMERASLACK
         self.cameraMovementStyle = None
+        # When False the game doesn't draw anything, only simulates.
+        self.rendering = True
+        # Only redraw and update the parts of the view that changed since the last frame.
+        self.dirtyRectMode = False
+        # Rectangles to update for the current frame, None to update everything.
+        self._dirtyRects = None
+        # What was drawn in the last frame: ( camera, background colour, object id -> ( obj, drawOrder, drawnRects ) ).
+        self._lastFrame = None
 
         if topLeft:
             self.setWindowPosition( topLeft )
@@ -78,6 +93,7 @@ class ViewPort( object ):
         size = ( width, height )
         self.displaySurface = pygame.display.set_mode( size, HWSURFACE | DOUBLEBUF | RESIZABLE )
         self.surface = self.displaySurface.convert()
+        self.invalidateDirtyRects()
 
 
     def resize( self, width, height ):
@@ -196,6 +212,74 @@ class ViewPort( object ):
         return Point( x, y )
 
 
+    def setDirtyRectMode( self, on = True ):
+        self.dirtyRectMode = on
+        self.invalidateDirtyRects()
+
+
+    # Forget what was drawn, so that the next frame is drawn in full.
+    def invalidateDirtyRects( self ):
+        self._lastFrame = None
+        self._dirtyRects = None
+
+
+    # Work out which parts of the view changed since the last frame, given the ordered list of drawn objects
+    # ( obj, drawnRects ) where drawnRects is a list of ( surface, rect ) of what the object draws.
+    # Returns the dirty rectangles, or None if the whole view needs drawing.
+    def findDirtyRects( self, drawnList, backGroundColour ):
+        lastFrame = self._lastFrame
+        camera = self.camera.asTuple()
+        frame = { id( obj ) : ( obj, obj.drawOrder, drawnRects ) for obj, drawnRects in drawnList }
+        self._lastFrame = ( camera, backGroundColour, frame )
+        self._dirtyRects = None
+
+        if lastFrame is None or lastFrame[0] != camera or lastFrame[1] != backGroundColour:
+            return None
+
+        lastObjects = dict( lastFrame[2] )
+        dirtyRects = []
+
+        for objId, entry in frame.items():
+            lastEntry = lastObjects.pop( objId, None )
+
+            if lastEntry is None or lastEntry[1:] != entry[1:]:
+                dirtyRects.extend( rect for surface, rect in entry[2] )
+
+                if lastEntry:
+                    dirtyRects.extend( rect for surface, rect in lastEntry[2] )
+
+        # Objects no longer drawn.
+        for lastEntry in lastObjects.values():
+            dirtyRects.extend( rect for surface, rect in lastEntry[2] )
+
+        viewRect = self.getViewportRect()
+        dirtyRects = [ viewRect.clip( rect ) for rect in dirtyRects ]
+        dirtyRects = [ rect for rect in dirtyRects if rect.width and rect.height ]
+
+        if len( dirtyRects ) > MAX_DIRTY_RECTS:
+            dirtyRects = [ dirtyRects[0].unionall( dirtyRects[1:] ) ]
+
+        if sum( rect.width * rect.height for rect in dirtyRects ) > MAX_DIRTY_AREA_FRACTION * viewRect.width * viewRect.height:
+            return None
+
+        self._dirtyRects = dirtyRects
+
+        return dirtyRects
+
+
+    # Record the drawing done by draw( viewPort ) in a game_utils.RenderSnapshot, instead of drawing it.
+    def recordDrawing( self, draw ):
+        surface = self.surface
+        self.surface = snapshot = gu.RenderSnapshot( surface )
+
+        try:
+            draw( self )
+        finally:
+            self.surface = surface
+
+        return snapshot
+
+
     def drawBackGround( self, colour ):
         self.backGroundColour = colour
         self.surface.fill( colour )
@@ -274,13 +358,22 @@ class ViewPort( object ):
 
     def postEvent( self, event ):
         if event:
-            pygame.event.post( event )
+            ge.eventBus.post( event )
 
 
     def update( self ):
-        viewRect = self.getViewportRect()
-        self.displaySurface.blit( self.surface, viewRect )
-        pygame.display.update( viewRect )
+        dirtyRects = self._dirtyRects
+
+        if dirtyRects is None:
+            viewRect = self.getViewportRect()
+            self.displaySurface.blit( self.surface, viewRect )
+            pygame.display.update( viewRect )
+        else:
+            for dirtyRect in dirtyRects:
+                self.displaySurface.blit( self.surface, dirtyRect, dirtyRect )
+
+            pygame.display.update( dirtyRects )
+            self._dirtyRects = None
 
 
     def playSound( self, soundFileName, ext = 'ogg', checkBusy = False, soundsDir = 'sounds' ):
@@ -324,3 +417,138 @@ class ViewPort( object ):
 
 
 
+
+# A viewport without a real display, using SDL's dummy video and audio drivers, for simulating and
+# benchmarking games on machines without a display. Surfaces can still be converted and drawn to,
+# so images load as normal, unless rendering is turned off.
+# Must be created before anything else initialises the pygame display.
+class HeadlessViewPort( ViewPort ):
+    headless = True
+
+
+    def __init__( self, width, height, rendering = True ):
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+        super().__init__( width, height )
+        self.rendering = rendering
+
+
+    def setWindowPosition( self, topLeft ):
+        pass
+
+
+    def setSize( self, width, height ):
+        self.width = width
+        self.height = height
+        self.halfWidth = int( width / 2 )
+        self.halfHeight = int( height / 2 )
+        # The dummy display is only needed as the target format for converting surfaces.
+        self.displaySurface = pygame.display.set_mode( ( width, height ) )
+        self.surface = self.displaySurface.convert()
+        self.invalidateDirtyRects()
+
+
+    def update( self ):
+        # Nothing to show.
+        self._dirtyRects = None
+
+
+    def playSound( self, soundFileName, ext = 'ogg', checkBusy = False, soundsDir = 'sounds' ):
+        pass
+
+
+
+
+# Draws recorded frames ( game_utils.RenderSnapshot ) on a separate thread, so that drawing one frame
+# overlaps with updating the next. Only the latest submitted frame is drawn, older ones are dropped.
+# Frames are drawn to a back buffer, which is swapped with the front buffer when done. The main thread
+# copies the front buffer to the view port with takeFrame(), as the display is only updated from there.
+class RenderThread( object ):
+    def __init__( self ):
+        self._condition = threading.Condition()
+        self._snapshot = None
+        self._rendering = False
+        self._running = False
+        self._thread = None
+        self._backBuffer = None
+        self._frontBuffer = None
+        self._newFrame = False
+
+
+    def start( self ):
+        if self._thread:
+            return
+
+        self._running = True
+        self._thread = threading.Thread( target=self.run, name='RenderThread', daemon=True )
+        self._thread.start()
+
+
+    def stop( self ):
+        if not self._thread:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        self._thread.join()
+        self._thread = None
+
+
+    # Replace any frame still waiting to be drawn.
+    def submit( self, snapshot ):
+        with self._condition:
+            self._snapshot = snapshot
+            self._condition.notify_all()
+
+
+    # Wait until all the submitted frames are drawn, before drawing to the view port directly.
+    def waitUntilIdle( self ):
+        with self._condition:
+            while self._running and ( self._snapshot is not None or self._rendering ):
+                self._condition.wait()
+
+
+    # Copy the latest drawn frame to the surface. Returns False if there isn't a new one.
+    def takeFrame( self, surface ):
+        with self._condition:
+            if not self._newFrame:
+                return False
+
+            surface.blit( self._frontBuffer, ( 0, 0 ) )
+            self._newFrame = False
+
+        return True
+
+
+    def run( self ):
+        condition = self._condition
+
+        while True:
+            with condition:
+                while self._running and self._snapshot is None:
+                    condition.wait()
+
+                if not self._running:
+                    return
+
+                snapshot = self._snapshot
+                self._snapshot = None
+                self._rendering = True
+
+            backBuffer = self._backBuffer
+
+            if backBuffer is None or backBuffer.get_size() != snapshot.get_size():
+                backBuffer = pygame.Surface( snapshot.get_size(), 0, snapshot.surface )
+
+            # Drawn without holding the lock, blits release the GIL so the game carries on meanwhile.
+            snapshot.render( backBuffer )
+
+            with condition:
+                self._backBuffer = self._frontBuffer
+                self._frontBuffer = backBuffer
+                self._newFrame = True
+                self._rendering = False
+                condition.notify_all()